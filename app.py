@@ -1,158 +1,3058 @@
-from flask import Flask, render_template, request, jsonify, redirect, session, send_from_directory
+from flask import Flask, render_template, request, jsonify, redirect, session, send_from_directory, Response, stream_with_context, url_for, g, has_request_context
 import sqlite3
 import os
-from datetime import datetime
+import sys
+import atexit
+import contextvars
+import csv
+import gzip
+import hashlib
+import hmac
+import io
+import json
+import logging
+import logging.handlers
+import math
+import mimetypes
+import re
+import tempfile
+import queue
+import threading
+import urllib.request
+import time
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor, TimeoutError as FutureTimeout
+from datetime import datetime, timezone
+from urllib.request import pathname2url
 import secrets
 from werkzeug.security import generate_password_hash, check_password_hash
 import pytz
+from markupsafe import Markup
 
-app = Flask(__name__, static_folder='static', static_url_path='/static')
+try:
+    import brotli
+except ImportError:  # brotli é opcional; sem ele os assets saem só em gzip
+    brotli = None
+
+try:
+    import fcntl
+except ImportError:  # Windows: sem lock entre processos (só há um no servidor de dev)
+    fcntl = None
+
+# /static é servido por send_static(), com nomes versionados por hash
+app = Flask(__name__, static_folder=None)
 app.secret_key = os.environ.get('SECRET_KEY', secrets.token_hex(32))
 
 # ============================================
-# BANCO DE DADOS
+# MÉTRICAS (PROMETHEUS)
+# ============================================
+
+# Um diretório por implantação: o padrão leva o PID do processo mestre
+# (gunicorn/uvicorn), para que snapshots de outros servidores no mesmo host
+# (benchmarks, desenvolvimento) não entrem na soma
+METRICS_DIR = os.environ.get('METRICS_DIR') or os.path.join(tempfile.gettempdir(), f'aurora-metrics-{os.getppid()}')
+METRICS_FLUSH_INTERVAL = 5  # segundos entre snapshots de cada worker
+METRICS_SNAPSHOT_TTL = 900  # segundos sem atualização até o snapshot de um worker morto ser apagado
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+METRIC_HELP = {
+    "aurora_http_requests_total": ("counter", "Requisições atendidas por rota, método e status"),
+    "aurora_http_request_duration_seconds": ("histogram", "Latência das requisições por rota"),
+    "aurora_db_time_seconds": ("histogram", "Tempo gasto no SQLite por requisição, por rota"),
+    "aurora_db_connections_opened_total": ("counter", "Conexões SQLite abertas"),
+    "aurora_alerts_inserted_total": ("counter", "Alertas gravados"),
+    "aurora_db_write_batch_seconds": ("histogram", "Duração de cada lote (transação) da thread de escrita"),
+    "aurora_alerts_archived_total": ("counter", "Alertas movidos da tabela quente para o arquivo mensal"),
+    "aurora_panic_replayed_total": ("counter", "Repetições de /api/panic respondidas pela chave de idempotência"),
+    "aurora_panic_coalesced_total": ("counter", "Alertas de uma rajada do mesmo cliente agrupados no anterior"),
+    "aurora_trail_points_total": ("counter", "Pontos de trajeto recebidos: stored, skipped (filtro), refused (buffer cheio), dropped (erro)"),
+    "aurora_notifications_total": ("counter", "Tentativas de notificação de contatos por transporte e resultado"),
+    "aurora_json_bytes_saved_total": ("counter", "Bytes economizados pela compressão das respostas JSON"),
+    "aurora_log_records_dropped_total": ("counter", "Registros de log descartados com a fila cheia"),
+    "aurora_requests_shed_total": ("counter", "Requisições recusadas com 503 por falta de vaga, por classe de rota"),
+    "aurora_requests_in_flight": ("gauge", "Requisições em execução no Flask, somando os workers"),
+    "aurora_confidant_streams": ("gauge", "Confidentes conectados por SSE"),
+    "aurora_confidant_pollers": ("gauge", "Confidentes distintos fazendo polling nos últimos 30 s"),
+}
+
+
+class Metrics:
+    """Contadores, histogramas e gauges em memória, baratos de atualizar.
+
+    Cada worker grava periodicamente um snapshot em METRICS_DIR; o /metrics
+    soma os snapshots de todos os workers. Contadores e histogramas de
+    workers que já morreram continuam somando por METRICS_SNAPSHOT_TTL e
+    depois o snapshot é apagado; gauges só dos vivos.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters = {}
+        self._histograms = {}
+        self._gauges = {}
+        self._flusher_pid = None
+
+    def inc(self, name, value=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def observe(self, name, value, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = [0] * len(LATENCY_BUCKETS) + [0.0, 0]
+            for i, bound in enumerate(LATENCY_BUCKETS):
+                if value <= bound:
+                    histogram[i] += 1
+            histogram[-2] += value
+            histogram[-1] += 1
+
+    def gauge(self, name, callback):
+        """Registra um gauge lido na hora do snapshot.
+
+        O callback devolve um número (somado entre workers) ou um conjunto de
+        identificadores (unidos entre workers, e o gauge é o tamanho da união).
+        """
+        self._gauges[name] = callback
+
+    def snapshot(self):
+        with self._lock:
+            counters = [[name, dict(labels), value] for (name, labels), value in self._counters.items()]
+            histograms = [[name, dict(labels), list(data)] for (name, labels), data in self._histograms.items()]
+        gauges = []
+        for name, callback in self._gauges.items():
+            value = callback()
+            gauges.append([name, {}, sorted(value) if isinstance(value, (set, frozenset)) else value])
+        return {"pid": os.getpid(), "counters": counters, "histograms": histograms, "gauges": gauges}
+
+    def flush(self):
+        """Grava o snapshot deste worker (troca atômica do arquivo)"""
+        os.makedirs(METRICS_DIR, exist_ok=True)
+        path = os.path.join(METRICS_DIR, f"worker-{os.getpid()}.json")
+        with open(path + ".tmp", "w") as f:
+            json.dump(self.snapshot(), f)
+        os.replace(path + ".tmp", path)
+
+    def start_flusher(self):
+        if self._flusher_pid == os.getpid():
+            return
+        self._flusher_pid = os.getpid()
+
+        def loop():
+            while True:
+                time.sleep(METRICS_FLUSH_INTERVAL)
+                try:
+                    self.flush()
+                except OSError:
+                    pass
+
+        threading.Thread(target=loop, name="metrics-flusher", daemon=True).start()
+
+    def collect(self):
+        """Soma os snapshots de todos os workers"""
+        counters, histograms, gauges = {}, {}, {}
+        snapshots = [self.snapshot()]
+        try:
+            names = os.listdir(METRICS_DIR)
+        except OSError:
+            names = []
+        stale = time.time() - METRICS_SNAPSHOT_TTL
+        for name in names:
+            if not name.startswith("worker-") or not name.endswith(".json"):
+                continue
+            path = os.path.join(METRICS_DIR, name)
+            try:
+                # Worker vivo regrava a cada METRICS_FLUSH_INTERVAL: parado há
+                # tanto tempo é de um worker morto (mesmo que o PID tenha sido
+                # reaproveitado por outro processo)
+                if os.path.getmtime(path) < stale:
+                    os.remove(path)
+                    continue
+                with open(path) as f:
+                    snapshot = json.load(f)
+            except (OSError, ValueError):
+                continue
+            if snapshot["pid"] != os.getpid():
+                snapshot["alive"] = _pid_alive(snapshot["pid"])
+                snapshots.append(snapshot)
+
+        for snapshot in snapshots:
+            for name, labels, value in snapshot["counters"]:
+                key = (name, tuple(sorted(labels.items())))
+                counters[key] = counters.get(key, 0) + value
+            for name, labels, data in snapshot["histograms"]:
+                key = (name, tuple(sorted(labels.items())))
+                total = histograms.setdefault(key, [0] * len(data))
+                for i, value in enumerate(data):
+                    total[i] += value
+            if snapshot.get("alive", True):
+                for name, labels, value in snapshot["gauges"]:
+                    if isinstance(value, list):
+                        gauges.setdefault(name, set()).update(value)
+                    else:
+                        gauges[name] = gauges.get(name, 0) + value
+        gauges = {name: len(value) if isinstance(value, set) else value for name, value in gauges.items()}
+        return counters, histograms, gauges
+
+    def render(self):
+        """Formato texto do Prometheus"""
+        counters, histograms, gauges = self.collect()
+        lines = []
+        for name, (kind, help_text) in METRIC_HELP.items():
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+            if kind == "counter":
+                for (metric, labels), value in sorted(counters.items()):
+                    if metric == name:
+                        lines.append(f"{name}{_labels(labels)} {value}")
+            elif kind == "gauge":
+                lines.append(f"{name} {gauges.get(name, 0)}")
+            else:
+                for (metric, labels), data in sorted(histograms.items()):
+                    if metric != name:
+                        continue
+                    for bound, count in zip(LATENCY_BUCKETS, data):
+                        lines.append(f"{name}_bucket{_labels(labels + (('le', repr(bound)),))} {count}")
+                    lines.append(f"{name}_bucket{_labels(labels + (('le', '+Inf'),))} {data[-1]}")
+                    lines.append(f"{name}_sum{_labels(labels)} {data[-2]}")
+                    lines.append(f"{name}_count{_labels(labels)} {data[-1]}")
+        return "\n".join(lines) + "\n"
+
+
+def _labels(labels):
+    """Formata os labels {k="v",...}, com o escape do formato texto"""
+    if not labels:
+        return ""
+    escape = lambda v: str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+    return "{" + ",".join(f'{k}="{escape(v)}"' for k, v in labels) + "}"
+
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except OSError:
+        return True
+    return True
+
+
+metrics = Metrics()
+
+# Tempo de SQLite acumulado pela requisição em andamento, por thread
+_db_timing = threading.local()
+
+
+class TimedCursor(sqlite3.Cursor):
+    """Cursor que soma em _db_timing o tempo de execute/fetch"""
+
+    def execute(self, *args):
+        started = time.perf_counter()
+        try:
+            return super().execute(*args)
+        finally:
+            _add_db_time(started)
+
+    def executemany(self, *args):
+        started = time.perf_counter()
+        try:
+            return super().executemany(*args)
+        finally:
+            _add_db_time(started)
+
+    def fetchone(self):
+        started = time.perf_counter()
+        try:
+            return super().fetchone()
+        finally:
+            _add_db_time(started)
+
+    def fetchmany(self, *args):
+        started = time.perf_counter()
+        try:
+            return super().fetchmany(*args)
+        finally:
+            _add_db_time(started)
+
+    def fetchall(self):
+        started = time.perf_counter()
+        try:
+            return super().fetchall()
+        finally:
+            _add_db_time(started)
+
+
+class TimedConnection(sqlite3.Connection):
+    """Conexão cujos execute/commit entram na métrica de tempo de banco"""
+
+    def execute(self, *args):
+        return self.cursor(TimedCursor).execute(*args)
+
+    def executemany(self, *args):
+        return self.cursor(TimedCursor).executemany(*args)
+
+    def commit(self):
+        started = time.perf_counter()
+        try:
+            return super().commit()
+        finally:
+            _add_db_time(started)
+
+
+def _add_db_time(started):
+    _db_timing.total = getattr(_db_timing, 'total', 0.0) + (time.perf_counter() - started)
+
+
+# Confidentes que fizeram polling recentemente (cliente -> último poll)
+POLLER_WINDOW = 30
+_pollers = {}
+_pollers_lock = threading.Lock()
+
+
+def track_poller():
+    client = f"{request.headers.get('X-Forwarded-For', request.remote_addr)} {request.user_agent.string}"
+    client = hashlib.sha1(client.encode()).hexdigest()[:16]
+    with _pollers_lock:
+        _pollers[client] = time.monotonic()
+
+
+def active_pollers():
+    """Conjunto (hash) dos clientes que fizeram polling na janela"""
+    cutoff = time.monotonic() - POLLER_WINDOW
+    with _pollers_lock:
+        for client in [c for c, seen in _pollers.items() if seen < cutoff]:
+            del _pollers[client]
+        return set(_pollers)
+
+
+metrics.gauge("aurora_confidant_pollers", active_pollers)
+
+
+@app.before_request
+def start_request_timer():
+    metrics.start_flusher()
+    g.request_started = time.perf_counter()
+    _db_timing.total = 0.0
+
+
+@app.teardown_request
+def record_request_metrics(exc):
+    started = g.pop("request_started", None)
+    if started is None:
+        return
+    route = request.url_rule.rule if request.url_rule else "<sem rota>"
+    status = g.pop("response_status", 500 if exc else 200)
+    metrics.observe("aurora_http_request_duration_seconds", time.perf_counter() - started, route=route, method=request.method)
+    metrics.observe("aurora_db_time_seconds", getattr(_db_timing, 'total', 0.0), route=route)
+    metrics.inc("aurora_http_requests_total", route=route, method=request.method, status=status)
+
+
+@app.after_request
+def remember_status(response):
+    g.response_status = response.status_code
+    return response
+
+# ============================================
+# LOGS ESTRUTURADOS
+# ============================================
+
+LOG_LEVEL = os.environ.get('LOG_LEVEL', 'INFO').upper()
+LOG_QUEUE_SIZE = 10000
+
+
+class JsonFormatter(logging.Formatter):
+    """Uma linha JSON por registro, com request_id e os campos extras"""
+
+    def format(self, record):
+        entry = {
+            "ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds").replace("+00:00", "Z"),
+            "level": record.levelname,
+            "msg": record.getMessage(),
+            "request_id": getattr(record, "request_id", None),
+        }
+        entry.update(getattr(record, "fields", {}))
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class RequestIdFilter(logging.Filter):
+    """Copia o request_id da requisição atual para o registro"""
+
+    def filter(self, record):
+        record.request_id = g.get("request_id") if has_request_context() else None
+        return True
+
+
+class NonBlockingQueueHandler(logging.handlers.QueueHandler):
+    """Formata na thread da requisição e só enfileira: nunca espera por I/O.
+
+    Com a fila cheia (stdout travado no Render, por exemplo) o registro é
+    descartado e contado em aurora_log_records_dropped_total.
+    """
+
+    def prepare(self, record):
+        line = self.format(record)
+        record = logging.makeLogRecord({"msg": line, "levelno": record.levelno, "levelname": record.levelname})
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            metrics.inc("aurora_log_records_dropped_total")
+
+
+log = logging.getLogger("aurora")
+log.setLevel(LOG_LEVEL)
+log.propagate = False
+_log_handler = NonBlockingQueueHandler(queue.Queue(LOG_QUEUE_SIZE))
+_log_handler.setFormatter(JsonFormatter())
+_log_handler.addFilter(RequestIdFilter())
+log.addHandler(_log_handler)
+_log_listener = None
+_log_listener_pid = None
+
+
+def start_log_listener():
+    """Thread que escreve os logs da fila no stdout (uma por worker)"""
+    global _log_listener, _log_listener_pid
+    if _log_listener_pid == os.getpid():
+        return
+    _log_listener_pid = os.getpid()
+    stream = logging.StreamHandler(sys.stdout)
+    stream.setFormatter(logging.Formatter("%(message)s"))
+    _log_listener = logging.handlers.QueueListener(_log_handler.queue, stream)
+    _log_listener.start()
+    atexit.register(_log_listener.stop)
+
+
+def log_event(level, msg, **fields):
+    """Registra um evento com campos estruturados"""
+    log.log(level, msg, extra={"fields": fields})
+
+
+start_log_listener()
+
+
+@app.before_request
+def assign_request_id():
+    start_log_listener()
+    g.request_id = request.headers.get("X-Request-ID") or secrets.token_hex(8)
+
+
+@app.after_request
+def return_request_id(response):
+    response.headers["X-Request-ID"] = g.get("request_id", "")
+    return response
+
+# ============================================
+# BANCO DE DADOS
+# ============================================
+
+DB_PATH = os.environ.get('DATABASE_PATH', 'database.db')
+
+# Pragmas aplicados a cada conexão nova. O WAL permite leituras (polling dos
+# confidentes) em paralelo com a escrita dos alertas.
+DB_PRAGMAS = (
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA busy_timeout=5000",
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA cache_size=-8000",
+    "PRAGMA mmap_size=67108864",
+)
+
+SCHEMA = (
+    # Tabela de alertas
+    """
+    CREATE TABLE IF NOT EXISTS alerts (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        date TEXT NOT NULL,
+        name TEXT NOT NULL,
+        situation TEXT NOT NULL,
+        message TEXT,
+        lat TEXT,
+        lng TEXT
+    )
+    """,
+    # Tabela de contatos (pessoas de confiança)
+    """
+    CREATE TABLE IF NOT EXISTS contacts (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        name TEXT NOT NULL,
+        phone TEXT NOT NULL,
+        relationship TEXT
+    )
+    """,
+)
+
+FUSO_BR = pytz.timezone('America/Sao_Paulo')
+FORMATO_DATA_BR = "%d/%m/%Y %H:%M:%S"
+
+# Dono dos alertas e contatos criados antes da separação por usuária (e de
+# quem ainda não tem sessão): o painel de demonstração
+DEFAULT_OWNER = "demo"
+
+DEMO_CONTACTS = (
+    ("CLECI", "(11) 99999-9999", "Irmã"),
+    ("MARIA", "(11) 98888-7777", "Mãe"),
+    ("JOÃO", "(11) 97777-6666", "Pai"),
+)
+
+_local = threading.local()
+
+# Commits feitos por este processo. O PRAGMA data_version só enxerga commits
+# de outras conexões, então este contador completa a detecção de mudanças.
+_local_writes = 0
+_local_writes_lock = threading.Lock()
+
+
+def connect_db():
+    """Abre uma conexão nova já com os pragmas aplicados"""
+    conn = sqlite3.connect(DB_PATH, timeout=5.0, factory=TimedConnection)
+    conn.row_factory = sqlite3.Row
+    metrics.inc("aurora_db_connections_opened_total")
+    for pragma in DB_PRAGMAS:
+        conn.execute(pragma)
+    return conn
+
+
+def get_db():
+    """Conexão reutilizada pela thread atual (uma por thread, por worker).
+
+    O PID é conferido para que um worker criado por fork nunca herde a
+    conexão aberta pelo processo pai.
+    """
+    conn = getattr(_local, 'conn', None)
+    if conn is None or _local.pid != os.getpid():
+        _local.__dict__.clear()
+        conn = connect_db()
+        _local.conn = conn
+        _local.pid = os.getpid()
+    return conn
+
+
+def mark_write():
+    """Registra um commit feito por este processo"""
+    global _local_writes
+    with _local_writes_lock:
+        _local_writes += 1
+
+
+def db_version():
+    """Chave barata que muda sempre que o banco é alterado.
+
+    Não lê nenhuma tabela: combina o PRAGMA data_version da conexão da thread
+    (commits de outros workers e threads) com o contador de commits locais.
+    """
+    data_version = get_db().execute("PRAGMA data_version").fetchone()[0]
+    return (data_version, _local_writes)
+
+
+def alerts_head(owners):
+    """ID do alerta mais recente das donas; só consulta se o banco mudou.
+
+    Um MAX(id) por dona, cada um resolvido no fim do índice (owner, id).
+    """
+    version = db_version()
+    cached = getattr(_local, 'alerts_head', None)
+    if cached is None or cached[0] != version:
+        cached = (version, {})
+        _local.alerts_head = cached
+    head = cached[1].get(owners)
+    if head is None:
+        conn = get_db()
+        head = max(
+            conn.execute("SELECT MAX(id) FROM alerts WHERE owner = ?", (owner,)).fetchone()[0] or 0
+            for owner in owners
+        )
+        cached[1][owners] = head
+    return head
+
+
+def parse_br_date(value):
+    """Converte a data BR gravada em alerts.date para epoch UTC (ou None)"""
+    try:
+        return int(FUSO_BR.localize(datetime.strptime(value, FORMATO_DATA_BR)).timestamp())
+    except (TypeError, ValueError):
+        return None
+
+
+# Intervalo aceito em from/to: folga de um ano em cada ponta para que o
+# instante convertido de/para o horário de Brasília caiba no datetime
+EPOCH_MIN = -2208988800  # 1900-01-01T00:00:00Z
+EPOCH_MAX = 253370764799  # 9998-12-31T23:59:59Z
+
+
+def parse_time_param(value):
+    """Lê um instante da query string: epoch em segundos ou ISO 8601.
+
+    ISO sem fuso é interpretado no horário de Brasília. ValueError se inválido.
+    """
+    if value is None or value == '':
+        return None
+    try:
+        number = float(value)
+    except ValueError:
+        number = None
+    if number is not None:
+        # inf/nan e números fora do alcance de datetime (e do INTEGER do SQLite)
+        if not math.isfinite(number) or not EPOCH_MIN <= number <= EPOCH_MAX:
+            raise ValueError(f"Instante fora do intervalo: {value}")
+        return int(number)
+    moment = datetime.fromisoformat(value)
+    try:
+        if moment.tzinfo is None:
+            moment = FUSO_BR.localize(moment)
+        epoch = int(moment.timestamp())
+    except (OverflowError, ValueError):
+        # Datas nas pontas do datetime (0001-01-01, 9999-12-31...) estouram
+        # ao converter de fuso
+        raise ValueError(f"Instante fora do intervalo: {value}") from None
+    if not EPOCH_MIN <= epoch <= EPOCH_MAX:
+        raise ValueError(f"Instante fora do intervalo: {value}")
+    return epoch
+
+
+def _migrate_created_at(conn):
+    """alerts.created_at: epoch UTC indexado, preenchido a partir da data BR"""
+    columns = {row['name'] for row in conn.execute("PRAGMA table_info(alerts)")}
+    if 'created_at' not in columns:
+        conn.execute("ALTER TABLE alerts ADD COLUMN created_at INTEGER")
+    rows = conn.execute("SELECT id, date FROM alerts WHERE created_at IS NULL").fetchall()
+    conn.executemany(
+        "UPDATE alerts SET created_at = ? WHERE id = ?",
+        [(parse_br_date(row['date']), row['id']) for row in rows]
+    )
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_alerts_created_at ON alerts(created_at)")
+
+
+def parse_coordinate(value, limit):
+    """Converte lat (limit=90) ou lng (limit=180) para float, ou None se inválida"""
+    try:
+        number = float(value)
+    except (TypeError, ValueError):
+        return None
+    if number != number or abs(number) > limit:
+        return None
+    return number
+
+
+def _migrate_numeric_coordinates(conn):
+    """lat/lng passam de TEXT para REAL, com índice R*Tree sobre as coordenadas.
+
+    O SQLite não altera o tipo de coluna, então a tabela é recriada. O
+    sqlite_sequence é preservado para que IDs apagados nunca sejam reusados.
+    """
+    conn.create_function("to_lat", 1, lambda v: parse_coordinate(v, 90), deterministic=True)
+    conn.create_function("to_lng", 1, lambda v: parse_coordinate(v, 180), deterministic=True)
+    sequence = conn.execute("SELECT seq FROM sqlite_sequence WHERE name = 'alerts'").fetchone()
+
+    conn.execute("""
+        CREATE TABLE alerts_new (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            date TEXT NOT NULL,
+            name TEXT NOT NULL,
+            situation TEXT NOT NULL,
+            message TEXT,
+            lat REAL,
+            lng REAL,
+            created_at INTEGER
+        )
+    """)
+    conn.execute("""
+        INSERT INTO alerts_new (id, date, name, situation, message, lat, lng, created_at)
+        SELECT id, date, name, situation, message, to_lat(lat), to_lng(lng), created_at
+        FROM alerts
+    """)
+    conn.execute("DROP TABLE alerts")
+    conn.execute("ALTER TABLE alerts_new RENAME TO alerts")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_alerts_created_at ON alerts(created_at)")
+    if sequence is not None:
+        conn.execute("DELETE FROM sqlite_sequence WHERE name = 'alerts'")
+        conn.execute("INSERT INTO sqlite_sequence (name, seq) VALUES ('alerts', ?)", (sequence['seq'],))
+
+    # Índice espacial: cada alerta com localização é um ponto (caixa degenerada)
+    conn.execute("CREATE VIRTUAL TABLE IF NOT EXISTS alerts_geo USING rtree(id, min_lat, max_lat, min_lng, max_lng)")
+    conn.execute("""
+        INSERT INTO alerts_geo (id, min_lat, max_lat, min_lng, max_lng)
+        SELECT id, lat, lat, lng, lng FROM alerts WHERE lat IS NOT NULL AND lng IS NOT NULL
+    """)
+    conn.execute("""
+        CREATE TRIGGER IF NOT EXISTS alerts_geo_ai AFTER INSERT ON alerts
+        WHEN new.lat IS NOT NULL AND new.lng IS NOT NULL
+        BEGIN
+            INSERT INTO alerts_geo (id, min_lat, max_lat, min_lng, max_lng)
+            VALUES (new.id, new.lat, new.lat, new.lng, new.lng);
+        END
+    """)
+    conn.execute("""
+        CREATE TRIGGER IF NOT EXISTS alerts_geo_au AFTER UPDATE OF lat, lng ON alerts
+        BEGIN
+            DELETE FROM alerts_geo WHERE id = old.id;
+            INSERT INTO alerts_geo (id, min_lat, max_lat, min_lng, max_lng)
+            SELECT new.id, new.lat, new.lat, new.lng, new.lng
+            WHERE new.lat IS NOT NULL AND new.lng IS NOT NULL;
+        END
+    """)
+    conn.execute("""
+        CREATE TRIGGER IF NOT EXISTS alerts_geo_ad AFTER DELETE ON alerts
+        BEGIN
+            DELETE FROM alerts_geo WHERE id = old.id;
+        END
+    """)
+
+
+def _migrate_table_versions(conn):
+    """Versão de contacts mantida por triggers, lida pelo cache de contatos"""
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS table_versions (
+            name TEXT PRIMARY KEY,
+            version INTEGER NOT NULL
+        ) WITHOUT ROWID
+    """)
+    conn.execute("INSERT OR IGNORE INTO table_versions (name, version) VALUES ('contacts', 1)")
+    for event in ("INSERT", "UPDATE", "DELETE"):
+        conn.execute(f"""
+            CREATE TRIGGER IF NOT EXISTS contacts_version_{event.lower()} AFTER {event} ON contacts
+            BEGIN
+                UPDATE table_versions SET version = version + 1 WHERE name = 'contacts';
+            END
+        """)
+
+
+def _migrate_owner(conn):
+    """Alertas e contatos ganham dona (owner) indexada; contatos ganham token.
+
+    O token do contato é o link de acesso da pessoa de confiança
+    (/confidant?t=...). A versão de contacts passa a ser uma por dona.
+    """
+    conn.execute(f"ALTER TABLE alerts ADD COLUMN owner TEXT NOT NULL DEFAULT '{DEFAULT_OWNER}'")
+    conn.execute(f"ALTER TABLE contacts ADD COLUMN owner TEXT NOT NULL DEFAULT '{DEFAULT_OWNER}'")
+    conn.execute("ALTER TABLE contacts ADD COLUMN token TEXT")
+    ids = [row['id'] for row in conn.execute("SELECT id FROM contacts")]
+    conn.executemany(
+        "UPDATE contacts SET token = ? WHERE id = ?",
+        [(secrets.token_urlsafe(16), contact_id) for contact_id in ids]
+    )
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_alerts_owner_id ON alerts(owner, id)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_alerts_owner_created_at ON alerts(owner, created_at)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_contacts_owner_id ON contacts(owner, id)")
+    conn.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_contacts_token ON contacts(token)")
+
+    conn.execute(
+        "UPDATE table_versions SET name = ? WHERE name = 'contacts'",
+        (f"contacts:{DEFAULT_OWNER}",)
+    )
+    for event in ("insert", "update", "delete"):
+        conn.execute(f"DROP TRIGGER IF EXISTS contacts_version_{event}")
+    bump = """
+        INSERT INTO table_versions (name, version) VALUES ('contacts:' || {row}.owner, 1)
+        ON CONFLICT(name) DO UPDATE SET version = version + 1;
+    """
+    for event, rows in (("INSERT", ("new",)), ("UPDATE", ("old", "new")), ("DELETE", ("old",))):
+        conn.execute(f"""
+            CREATE TRIGGER IF NOT EXISTS contacts_version_{event.lower()} AFTER {event} ON contacts
+            BEGIN
+                {"".join(bump.format(row=row) for row in rows)}
+            END
+        """)
+
+
+def _migrate_notifications(conn):
+    """Fila de notificações dos contatos, com status de entrega por tentativa"""
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS notifications (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            alert_id INTEGER NOT NULL,
+            contact_id INTEGER NOT NULL,
+            transport TEXT NOT NULL,
+            status TEXT NOT NULL DEFAULT 'pending',
+            attempts INTEGER NOT NULL DEFAULT 0,
+            next_attempt_at INTEGER NOT NULL,
+            claimed_by TEXT,
+            last_error TEXT,
+            updated_at INTEGER NOT NULL
+        )
+    """)
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_notifications_due ON notifications(status, next_attempt_at)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_notifications_alert ON notifications(alert_id)")
+
+
+STATS_TRIGGERS = (
+    """
+    CREATE TRIGGER IF NOT EXISTS stats_alerts_ai AFTER INSERT ON alerts
+    BEGIN
+        INSERT INTO stats (bucket, key, count) VALUES ('total', '', 1)
+        ON CONFLICT(bucket, key) DO UPDATE SET count = count + 1;
+        INSERT INTO stats (bucket, key, count) VALUES ('situation', new.situation, 1)
+        ON CONFLICT(bucket, key) DO UPDATE SET count = count + 1;
+        INSERT INTO stats (bucket, key, count)
+        SELECT 'hour', strftime('%Y-%m-%dT%H', new.created_at, 'unixepoch'), 1 WHERE new.created_at IS NOT NULL
+        ON CONFLICT(bucket, key) DO UPDATE SET count = count + 1;
+        INSERT INTO stats (bucket, key, count)
+        SELECT 'day', strftime('%Y-%m-%d', new.created_at, 'unixepoch'), 1 WHERE new.created_at IS NOT NULL
+        ON CONFLICT(bucket, key) DO UPDATE SET count = count + 1;
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS stats_contacts_ai AFTER INSERT ON contacts
+    BEGIN
+        INSERT INTO stats (bucket, key, count) VALUES ('contacts', '', 1)
+        ON CONFLICT(bucket, key) DO UPDATE SET count = count + 1;
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS stats_contacts_ad AFTER DELETE ON contacts
+    BEGIN
+        UPDATE stats SET count = count - 1 WHERE bucket = 'contacts' AND key = '';
+    END
+    """,
+)
+
+
+def _migrate_stats(conn):
+    """Contadores mantidos por trigger na mesma transação de cada INSERT.
+
+    Buckets: 'total', 'situation', 'hour' e 'day' (UTC) dos alertas e
+    'contacts'. Só somam: alertas movidos para o arquivo continuam contados.
+    """
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS stats (
+            bucket TEXT NOT NULL,
+            key TEXT NOT NULL,
+            count INTEGER NOT NULL,
+            PRIMARY KEY (bucket, key)
+        ) WITHOUT ROWID
+    """)
+    conn.execute("""
+        INSERT INTO stats (bucket, key, count)
+        SELECT 'total', '', COUNT(*) FROM alerts
+        UNION ALL SELECT 'contacts', '', COUNT(*) FROM contacts
+        UNION ALL SELECT 'situation', situation, COUNT(*) FROM alerts GROUP BY situation
+        UNION ALL SELECT 'hour', strftime('%Y-%m-%dT%H', created_at, 'unixepoch'), COUNT(*)
+                  FROM alerts WHERE created_at IS NOT NULL GROUP BY 2
+        UNION ALL SELECT 'day', strftime('%Y-%m-%d', created_at, 'unixepoch'), COUNT(*)
+                  FROM alerts WHERE created_at IS NOT NULL GROUP BY 2
+    """)
+    for trigger in STATS_TRIGGERS:
+        conn.execute(trigger)
+
+
+def _migrate_search(conn):
+    """Índice FTS5 de nome, situação e mensagem dos alertas.
+
+    Tabela de conteúdo externo (não duplica o texto), mantida por triggers e
+    preenchida com 'rebuild'. A coluna owner entra no índice para a busca já
+    filtrar pelas donas dentro do MATCH.
+    """
+    conn.execute("""
+        CREATE VIRTUAL TABLE IF NOT EXISTS alerts_fts USING fts5(
+            name, situation, message, owner,
+            content='alerts', content_rowid='id',
+            tokenize='unicode61 remove_diacritics 2', prefix='2 3'
+        )
+    """)
+    conn.execute("""
+        CREATE TRIGGER IF NOT EXISTS alerts_fts_ai AFTER INSERT ON alerts
+        BEGIN
+            INSERT INTO alerts_fts (rowid, name, situation, message, owner)
+            VALUES (new.id, new.name, new.situation, new.message, new.owner);
+        END
+    """)
+    conn.execute("""
+        CREATE TRIGGER IF NOT EXISTS alerts_fts_au AFTER UPDATE OF name, situation, message, owner ON alerts
+        BEGIN
+            INSERT INTO alerts_fts (alerts_fts, rowid, name, situation, message, owner)
+            VALUES ('delete', old.id, old.name, old.situation, old.message, old.owner);
+            INSERT INTO alerts_fts (rowid, name, situation, message, owner)
+            VALUES (new.id, new.name, new.situation, new.message, new.owner);
+        END
+    """)
+    conn.execute("""
+        CREATE TRIGGER IF NOT EXISTS alerts_fts_ad AFTER DELETE ON alerts
+        BEGIN
+            INSERT INTO alerts_fts (alerts_fts, rowid, name, situation, message, owner)
+            VALUES ('delete', old.id, old.name, old.situation, old.message, old.owner);
+        END
+    """)
+    conn.execute("INSERT INTO alerts_fts (alerts_fts) VALUES ('rebuild')")
+
+
+def _migrate_trail(conn):
+    """Trajeto dos alertas ativos: pontos já reduzidos por distância e tempo.
+
+    Os pontos saem da tabela junto com o alerta, pelo trigger de DELETE (a
+    retenção copia antes para o arquivo mensal).
+    """
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS alert_locations (
+            id INTEGER PRIMARY KEY,
+            alert_id INTEGER NOT NULL,
+            lat REAL NOT NULL,
+            lng REAL NOT NULL,
+            accuracy REAL,
+            recorded_at INTEGER NOT NULL
+        )
+    """)
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_alert_locations_alert_id ON alert_locations(alert_id, id)")
+    conn.execute("""
+        CREATE TRIGGER IF NOT EXISTS alert_locations_ad AFTER DELETE ON alerts
+        BEGIN
+            DELETE FROM alert_locations WHERE alert_id = old.id;
+        END
+    """)
+
+
+OWNER_STATS_TRIGGERS = (
+    """
+    CREATE TRIGGER IF NOT EXISTS stats_alerts_ai AFTER INSERT ON alerts
+    BEGIN
+        INSERT INTO stats (owner, bucket, key, count) VALUES (new.owner, 'total', '', 1)
+        ON CONFLICT(owner, bucket, key) DO UPDATE SET count = count + 1;
+        INSERT INTO stats (owner, bucket, key, count) VALUES (new.owner, 'situation', new.situation, 1)
+        ON CONFLICT(owner, bucket, key) DO UPDATE SET count = count + 1;
+        INSERT INTO stats (owner, bucket, key, count)
+        SELECT new.owner, 'hour', strftime('%Y-%m-%dT%H', new.created_at, 'unixepoch'), 1
+        WHERE new.created_at IS NOT NULL
+        ON CONFLICT(owner, bucket, key) DO UPDATE SET count = count + 1;
+        INSERT INTO stats (owner, bucket, key, count)
+        SELECT new.owner, 'day', strftime('%Y-%m-%d', new.created_at, 'unixepoch'), 1
+        WHERE new.created_at IS NOT NULL
+        ON CONFLICT(owner, bucket, key) DO UPDATE SET count = count + 1;
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS stats_contacts_ai AFTER INSERT ON contacts
+    BEGIN
+        INSERT INTO stats (owner, bucket, key, count) VALUES (new.owner, 'contacts', '', 1)
+        ON CONFLICT(owner, bucket, key) DO UPDATE SET count = count + 1;
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS stats_contacts_ad AFTER DELETE ON contacts
+    BEGIN
+        UPDATE stats SET count = count - 1 WHERE owner = old.owner AND bucket = 'contacts' AND key = '';
+    END
+    """,
+)
+
+
+def _migrate_stats_by_owner(conn):
+    """Contadores de stats passam a ser por dona, como todas as outras leituras.
+
+    Os totais globais mostravam a atividade (e as situações digitadas) de
+    todas as usuárias a qualquer visitante. A recontagem parte da tabela
+    alerts, então alertas já arquivados deixam de ser contados.
+    """
+    for trigger in ("stats_alerts_ai", "stats_contacts_ai", "stats_contacts_ad"):
+        conn.execute(f"DROP TRIGGER IF EXISTS {trigger}")
+    conn.execute("DROP TABLE IF EXISTS stats")
+    conn.execute("""
+        CREATE TABLE stats (
+            owner TEXT NOT NULL,
+            bucket TEXT NOT NULL,
+            key TEXT NOT NULL,
+            count INTEGER NOT NULL,
+            PRIMARY KEY (owner, bucket, key)
+        ) WITHOUT ROWID
+    """)
+    conn.execute("""
+        INSERT INTO stats (owner, bucket, key, count)
+        SELECT owner, 'total', '', COUNT(*) FROM alerts GROUP BY owner
+        UNION ALL SELECT owner, 'contacts', '', COUNT(*) FROM contacts GROUP BY owner
+        UNION ALL SELECT owner, 'situation', situation, COUNT(*) FROM alerts GROUP BY owner, situation
+        UNION ALL SELECT owner, 'hour', strftime('%Y-%m-%dT%H', created_at, 'unixepoch'), COUNT(*)
+                  FROM alerts WHERE created_at IS NOT NULL GROUP BY 1, 3
+        UNION ALL SELECT owner, 'day', strftime('%Y-%m-%d', created_at, 'unixepoch'), COUNT(*)
+                  FROM alerts WHERE created_at IS NOT NULL GROUP BY 1, 3
+    """)
+    for trigger in OWNER_STATS_TRIGGERS:
+        conn.execute(trigger)
+
+
+# Migrações em ordem; PRAGMA user_version guarda quantas já foram aplicadas
+MIGRATIONS = (
+    _migrate_created_at,
+    _migrate_numeric_coordinates,
+    _migrate_table_versions,
+    _migrate_owner,
+    _migrate_notifications,
+    _migrate_stats,
+    _migrate_search,
+    _migrate_trail,
+    _migrate_stats_by_owner,
+)
+
+
+INIT_BUSY_TIMEOUT_MS = 30 * 60 * 1000
+
+
+def init_db():
+    """Cria o schema e insere os contatos demo, uma vez por processo.
+
+    Roda dentro de BEGIN IMMEDIATE: com vários workers do gunicorn subindo
+    ao mesmo tempo, só um deles consegue o lock de escrita por vez, então o
+    seed e as migrações nunca rodam em dobro. Os outros esperam num lock de
+    arquivo sem prazo (e não nos 5 s do busy_timeout das requisições), porque
+    uma migração grande pode levar minutos e um "database is locked" no
+    import derrubaria o gunicorn inteiro.
+    """
+    lock = None
+    if fcntl is not None:
+        lock = open(f"{DB_PATH}.init.lock", "a")
+        fcntl.flock(lock, fcntl.LOCK_EX)
+    conn = connect_db()
+    try:
+        # Sem fcntl (Windows) quem espera é o próprio SQLite
+        conn.execute(f"PRAGMA busy_timeout = {INIT_BUSY_TIMEOUT_MS}")
+        conn.isolation_level = None
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            for ddl in SCHEMA:
+                conn.execute(ddl)
+
+            version = conn.execute("PRAGMA user_version").fetchone()[0]
+            for number, migration in enumerate(MIGRATIONS[version:], start=version + 1):
+                migration(conn)
+                conn.execute(f"PRAGMA user_version = {number}")
+
+            # Inserir contatos demo se não existirem
+            demo = conn.execute("SELECT COUNT(*) as total FROM contacts").fetchone()
+            if demo['total'] == 0:
+                conn.executemany(
+                    "INSERT INTO contacts (name, phone, relationship, owner, token) VALUES (?, ?, ?, ?, ?)",
+                    [contact + (DEFAULT_OWNER, secrets.token_urlsafe(16)) for contact in DEMO_CONTACTS]
+                )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+    finally:
+        conn.close()
+        if lock is not None:
+            lock.close()
+
+
+@app.teardown_appcontext
+def release_db(exc):
+    """Garante que nenhuma transação aberta vaze para a próxima requisição"""
+    conn = getattr(_local, 'conn', None)
+    if conn is not None and _local.pid == os.getpid() and conn.in_transaction:
+        conn.rollback()
+
+
+init_db()
+
+# ============================================
+# DIFUSÃO DE ALERTAS EM TEMPO REAL (SSE)
+# ============================================
+
+SSE_QUEUE_SIZE = 100
+SSE_HEARTBEAT = 15  # segundos entre comentários de keep-alive
+SSE_TAIL_INTERVAL = 0.25  # segundos entre checagens de alertas de outros workers
+LONG_POLL_MAX = 25  # segundos máximos de espera no ?wait= do /history_json
+
+
+class AlertSubscriber:
+    """Fila limitada de um confidente conectado.
+
+    Só recebe alertas das donas que ele acompanha. Se o confidente não
+    consumir a tempo e a fila encher, ele é marcado como atrasado e o stream
+    é encerrado; o EventSource reconecta com Last-Event-ID e recupera do
+    banco o que perdeu.
+    """
+
+    def __init__(self, owners, maxsize=SSE_QUEUE_SIZE):
+        self.owners = frozenset(owners)
+        self.queue = queue.Queue(maxsize)
+        self.lagged = False
+
+    def deliver(self, alert):
+        if alert["owner"] not in self.owners:
+            return
+        try:
+            self.queue.put_nowait(alert)
+        except queue.Full:
+            self.lagged = True
+
+
+class AlertBroadcaster:
+    """Distribui cada alerta novo para todos os confidentes deste worker.
+
+    Uma única thread por worker acompanha o PRAGMA data_version e lê do banco
+    só os IDs novos, em ordem, para entregar a cada assinante. Assim alertas
+    gravados por outros workers do gunicorn também chegam; os gravados por
+    este processo chamam notify() e são entregues sem esperar a próxima
+    checagem.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._subscribers = set()
+        self._wakeup = threading.Event()
+        self._tailer_pid = None
+
+    def subscribe(self, owners):
+        return self.attach(AlertSubscriber(owners))
+
+    def attach(self, subscriber):
+        """Registra um assinante já criado (o modo ASGI usa um assíncrono)"""
+        with self._lock:
+            self._subscribers.add(subscriber)
+            if self._tailer_pid != os.getpid():
+                self._tailer_pid = os.getpid()
+                threading.Thread(target=self._tail, name="alert-tailer", daemon=True).start()
+        return subscriber
+
+    def unsubscribe(self, subscriber):
+        with self._lock:
+            self._subscribers.discard(subscriber)
+
+    def subscriber_count(self):
+        return len(self._subscribers)
+
+    def notify(self):
+        """Avisa que um alerta acabou de ser gravado por este processo"""
+        self._wakeup.set()
+
+    def _publish(self, alert):
+        with self._lock:
+            subscribers = list(self._subscribers)
+        for subscriber in subscribers:
+            subscriber.deliver(alert)
+
+    def _tail(self):
+        conn = connect_db()
+        last_id = conn.execute("SELECT MAX(id) FROM alerts").fetchone()[0] or 0
+        last_version = None
+        while True:
+            try:
+                version = conn.execute("PRAGMA data_version").fetchone()[0]
+                if version != last_version:
+                    last_version = version
+                    rows = conn.execute(
+                        "SELECT * FROM alerts WHERE id > ? ORDER BY id", (last_id,)
+                    ).fetchall()
+                    for row in rows:
+                        last_id = row["id"]
+                        self._publish(dict(row))
+            except sqlite3.Error as e:
+                log_event(logging.ERROR, "Erro ao acompanhar alertas", error=str(e))
+            self._wakeup.wait(SSE_TAIL_INTERVAL)
+            self._wakeup.clear()
+
+
+broadcaster = AlertBroadcaster()
+metrics.gauge("aurora_confidant_streams", broadcaster.subscriber_count)
+
+
+def sse_event(alert):
+    """Formata um alerta como evento SSE"""
+    data = json.dumps(alert, ensure_ascii=False, separators=(",", ":"))
+    return f"id: {alert['id']}\nevent: alert\ndata: {data}\n\n"
+
+# ============================================
+# GRAVAÇÃO DE ALERTAS EM LOTE (GROUP COMMIT)
+# ============================================
+
+WRITE_QUEUE_SIZE = int(os.environ.get('WRITE_QUEUE_SIZE', 1000))
+WRITE_BATCH_MAX = 200
+WRITE_BATCH_WINDOW = 0.005  # segundos esperando mais gravações para o mesmo commit
+WRITE_TIMEOUT = 10  # segundos que a requisição espera pela gravação
+
+
+class WriterBusy(Exception):
+    """A fila de gravação está cheia"""
+
+
+class WriteFuture(Future):
+    """Future de uma gravação do DbWriter. A transação roda na thread de
+    escrita, fora do alcance do TimedConnection da requisição: o tempo que a
+    requisição espera em result() conta como tempo de banco dela."""
+
+    def result(self, timeout=None):
+        started = time.perf_counter()
+        try:
+            return super().result(timeout)
+        finally:
+            _add_db_time(started)
+
+
+class DbWriter:
+    """Thread única por worker que grava no banco em lotes.
+
+    Cada gravação é uma função que recebe a conexão e devolve um resultado.
+    As que chegam juntas (uma rajada de SOS, por exemplo) rodam na mesma
+    transação, com um único commit/fsync, e cada chamador recebe seu próprio
+    resultado por um Future. Se o lote falhar, as gravações são repetidas uma
+    a uma para que um item inválido não derrube os outros.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._queue = None
+        self._pid = None
+
+    def submit(self, job):
+        """Enfileira job(conn) e devolve um WriteFuture; WriterBusy se a fila encheu"""
+        with self._lock:
+            if self._pid != os.getpid():
+                self._pid = os.getpid()
+                self._queue = queue.Queue(WRITE_QUEUE_SIZE)
+                threading.Thread(target=self._run, args=(self._queue,), name="db-writer", daemon=True).start()
+            jobs = self._queue
+        future = WriteFuture()
+        try:
+            jobs.put_nowait((job, future))
+        except queue.Full:
+            raise WriterBusy()
+        return future
+
+    def _run(self, jobs):
+        conn = connect_db()
+        while True:
+            batch = [jobs.get()]
+            deadline = time.monotonic() + WRITE_BATCH_WINDOW
+            while len(batch) < WRITE_BATCH_MAX:
+                remaining = deadline - time.monotonic()
+                try:
+                    batch.append(jobs.get(timeout=remaining) if remaining > 0 else jobs.get_nowait())
+                except queue.Empty:
+                    break
+
+            try:
+                self._commit(conn, batch)
+            except Exception:
+                for item in batch:
+                    try:
+                        self._commit(conn, [item])
+                    except Exception as e:
+                        item[1].set_exception(e)
+
+    def _commit(self, conn, batch):
+        started = time.perf_counter()
+        with conn:
+            results = [job(conn) for job, _ in batch]
+        metrics.observe("aurora_db_write_batch_seconds", time.perf_counter() - started)
+        mark_write()
+        broadcaster.notify()
+        dispatcher.wake()
+        for (_, future), result in zip(batch, results):
+            future.set_result(result)
+
+
+db_writer = DbWriter()
+
+
+INSERT_ALERT = """
+    INSERT INTO alerts (date, name, situation, message, lat, lng, created_at, owner)
+    VALUES (:date, :name, :situation, :message, :lat, :lng, :created_at, :owner)
+"""
+
+
+def insert_alert(conn, alert):
+    """Insere um alerta (e as notificações dos contatos) e devolve o ID gerado"""
+    alert_id = conn.execute(INSERT_ALERT, alert).lastrowid
+    queue_notifications(conn, alert_id, alert_id)
+    return alert_id
+
+
+def insert_alerts(conn, alerts):
+    """Insere vários alertas com um executemany e devolve os IDs, na mesma ordem.
+
+    Dentro da transação a escrita está travada e o AUTOINCREMENT dá IDs
+    consecutivos, então os IDs são os últimos len(alerts) do sqlite_sequence.
+    """
+    conn.executemany(INSERT_ALERT, alerts)
+    last = conn.execute("SELECT seq FROM sqlite_sequence WHERE name = 'alerts'").fetchone()[0]
+    queue_notifications(conn, last - len(alerts) + 1, last)
+    return list(range(last - len(alerts) + 1, last + 1))
+
+# ============================================
+# CACHE DE CONTATOS
+# ============================================
+
+CONTACTS_CACHE_OWNERS = 1000  # donas mantidas em memória (as menos usadas saem)
+
+
+class ContactsCache:
+    """Listas de contatos em memória, uma por dona, versionadas.
+
+    A versão é a linha 'contacts:<dona>' de table_versions, incrementada por
+    trigger a cada mudança nos contatos da dona, venha de qualquer worker. A
+    linha só é lida quando db_version() mudou desde a última checagem da
+    thread, e a lista só é relida (pelo índice owner, id) quando a versão
+    muda. adicionar_contato() e apagar_contato() atualizam o cache deste
+    processo no lugar, sem reler a tabela.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # dona -> (versão, contatos)
+
+    def get(self, owner):
+        """(versão, contatos da dona em ordem de ID)"""
+        db_key = db_version()
+        checked = getattr(_local, 'contacts_checked', None)
+        if checked is None or checked[0] != db_key:
+            checked = (db_key, set())
+            _local.contacts_checked = checked
+        with self._lock:
+            entry = self._entries.get(owner)
+            if entry is not None:
+                self._entries.move_to_end(owner)
+        if entry is None or owner not in checked[1]:
+            conn = get_db()
+            version = current_contacts_version(conn, owner)
+            if entry is None or entry[0] != version:
+                rows = conn.execute(
+                    "SELECT * FROM contacts WHERE owner = ? ORDER BY id", (owner,)
+                ).fetchall()
+                entry = (version, tuple(dict(row) for row in rows))
+                self._store(owner, entry)
+            checked[1].add(owner)
+        return entry
+
+    def _store(self, owner, entry):
+        with self._lock:
+            self._entries[owner] = entry
+            self._entries.move_to_end(owner)
+            while len(self._entries) > CONTACTS_CACHE_OWNERS:
+                self._entries.popitem(last=False)
+
+    def added(self, contact, version):
+        """Aplica um INSERT já commitado que levou a dona para `version`"""
+        with self._lock:
+            entry = self._entries.get(contact['owner'])
+            if entry is not None and entry[0] == version - 1:
+                self._entries[contact['owner']] = (version, entry[1] + (contact,))
+            else:
+                self._entries.pop(contact['owner'], None)
+
+    def removed(self, owner, contact_id, version):
+        """Aplica um DELETE já commitado que levou a dona para `version`"""
+        with self._lock:
+            entry = self._entries.get(owner)
+            if entry is not None and entry[0] == version - 1:
+                self._entries[owner] = (version, tuple(c for c in entry[1] if c['id'] != contact_id))
+            else:
+                self._entries.pop(owner, None)
+
+
+def current_contacts_version(conn, owner):
+    row = conn.execute(
+        "SELECT version FROM table_versions WHERE name = ?", (f"contacts:{owner}",)
+    ).fetchone()
+    return row[0] if row else 0
+
+
+contacts_cache = ContactsCache()
+
+# ============================================
+# DONAS DOS DADOS (SEPARAÇÃO POR USUÁRIA)
+# ============================================
+
+def current_owner(create=False):
+    """Dona da sessão atual; create=True cria uma nova para quem não tem"""
+    owner = session.get("owner")
+    if owner is None and create:
+        owner = session["owner"] = secrets.token_urlsafe(16)
+        session.permanent = True
+    return owner or DEFAULT_OWNER
+
+
+def follow_token(token):
+    """Guarda na sessão o link de acesso de um contato (/confidant?t=)"""
+    tokens = session.get("follows", [])
+    if token not in tokens:
+        session["follows"] = tokens + [token]
+        session.permanent = True
+
+
+def viewer_owners():
+    """Donas cujos alertas a sessão atual pode ver, como tupla ordenada.
+
+    A própria dona (se houver) mais as que cadastraram esta pessoa como
+    contato, pelos tokens guardados na sessão. Apagar o contato revoga o
+    acesso. Sem nada disso, o painel de demonstração.
+    """
+    owners = set()
+    if "owner" in session:
+        owners.add(session["owner"])
+    tokens = tuple(session.get("follows", ()))
+    if tokens:
+        db_key = db_version()
+        cached = getattr(_local, 'followed', None)
+        if cached is None or cached[0] != (db_key, tokens):
+            placeholders = ", ".join("?" * len(tokens))
+            rows = get_db().execute(
+                f"SELECT DISTINCT owner FROM contacts WHERE token IN ({placeholders})", tokens
+            ).fetchall()
+            cached = ((db_key, tokens), {row[0] for row in rows})
+            _local.followed = cached
+        owners |= cached[1]
+    return tuple(sorted(owners)) or (DEFAULT_OWNER,)
+
+
+def owners_tag(owners):
+    """Identificador curto do conjunto de donas, para compor ETags"""
+    return hashlib.sha1("\n".join(owners).encode()).hexdigest()[:8]
+
+
+def owner_clause(owners, column="owner"):
+    """Trecho WHERE e parâmetros que restringem a consulta às donas"""
+    return f"{column} IN ({', '.join('?' * len(owners))})", list(owners)
+
+# ============================================
+# RESPOSTAS JSON (CAMPOS E COMPRESSÃO)
+# ============================================
+
+# JSON compacto e com acentos em UTF-8 (um "á" ocupa 2 bytes, e não os 6 de "\u00e1")
+app.json.compact = True
+app.json.ensure_ascii = False
+app.json.sort_keys = False
+
+# Respostas menores que isso cabem num pacote; comprimir só gastaria CPU
+JSON_COMPRESS_MIN = int(os.environ.get('JSON_COMPRESS_MIN', 1024))
+
+# Colunas que ?fields= pode pedir, na ordem da resposta
+ALERT_FIELDS = ("id", "date", "name", "situation", "message", "lat", "lng", "created_at", "owner")
+CONTACT_FIELDS = ("id", "name", "phone", "relationship", "owner", "token")
+
+
+def requested_fields(allowed):
+    """Colunas de ?fields=a,b (o id vem sempre), ou None para todas.
+
+    Levanta ValueError se algum nome não estiver em `allowed`: os nomes vão
+    para o SELECT, então só passam os da lista fixa.
+    """
+    raw = request.args.get("fields", "")
+    names = {name.strip() for name in raw.split(",") if name.strip()}
+    if not names:
+        return None
+    if not names <= set(allowed):
+        raise ValueError(", ".join(sorted(names - set(allowed))))
+    return tuple(name for name in allowed if name in names or name == "id")
+
+
+def select_columns(fields, prefix=""):
+    """Lista do SELECT para os campos pedidos (todas as colunas se None)"""
+    return ", ".join(prefix + name for name in fields) if fields else prefix + "*"
+
+
+def fields_error(exc):
+    return jsonify({"status": "error", "message": f"Campos desconhecidos em ?fields=: {exc}"}), 400
+
+
+@app.after_request
+def compress_json(response):
+    """Comprime em brotli ou gzip as respostas JSON acima de JSON_COMPRESS_MIN"""
+    if (response.mimetype != "application/json" or response.status_code != 200
+            or response.direct_passthrough or response.is_streamed
+            or "Content-Encoding" in response.headers):
+        return response
+    response.vary.add("Accept-Encoding")
+    body = response.get_data()
+    if len(body) < JSON_COMPRESS_MIN:
+        return response
+    if brotli is not None and "br" in request.accept_encodings:
+        encoding, compressed = "br", brotli.compress(body, quality=5)
+    elif "gzip" in request.accept_encodings:
+        encoding, compressed = "gzip", gzip.compress(body, 6, mtime=0)
+    else:
+        return response
+    response.set_data(compressed)
+    response.headers["Content-Encoding"] = encoding
+    metrics.inc("aurora_json_bytes_saved_total", len(body) - len(compressed), encoding=encoding)
+    return response
+
+# ============================================
+# PRIORIDADE DAS REQUISIÇÕES (FILAS POR CLASSE)
+# ============================================
+
+# Classes de rota pelo endpoint do Flask; o que não está listado é "normal"
+CRITICAL_ENDPOINTS = frozenset({"api_panic", "api_panic_batch", "healthz", "readyz"})
+LOW_ENDPOINTS = frozenset({
+    "gerenciar_contatos", "testar_sirene_direto", "diagnostico", "historico",
+    "alerts_export", "alerts_archive", "alerts_search", "api_stats",
+})
+
+# Conexões longas (SSE, long-poll) passam o tempo esperando, sem trabalho:
+# ficam fora da contagem de vagas
+STREAM_ENDPOINTS = frozenset({"alerts_stream"})
+
+LANE_SLOTS = int(os.environ.get('LANE_SLOTS', 32))  # requisições simultâneas por worker
+LANE_CRITICAL_RESERVED = int(os.environ.get('LANE_CRITICAL_RESERVED', 4))  # vagas só das críticas
+LANE_LOW_SLOTS = int(os.environ.get('LANE_LOW_SLOTS', 8))  # teto das de baixa prioridade
+LANE_RETRY_AFTER = 2  # segundos sugeridos no 503 de descarte
+
+_lane_adapter = app.url_map.bind("localhost")
+
+# Classe já admitida pela camada ASGI, para o Flask não contar de novo
+admitted_lane = contextvars.ContextVar("admitted_lane", default=None)
+
+
+def request_lane(path, method="GET", endpoint=None, waiting=False):
+    """'critical', 'normal', 'low' ou 'stream' (não contada) para a rota"""
+    if endpoint is None:
+        try:
+            endpoint, _ = _lane_adapter.match(path, method)
+        except Exception:  # 404, 405, redirecionamento: nada caro a proteger
+            return "normal"
+    if endpoint in STREAM_ENDPOINTS or (endpoint == "history_json" and waiting):
+        return "stream"
+    if endpoint in CRITICAL_ENDPOINTS:
+        return "critical"
+    return "low" if endpoint in LOW_ENDPOINTS else "normal"
+
+
+class RequestLanes:
+    """Vagas de execução por classe de rota, em memória por worker.
+
+    As críticas (/api/panic, health checks) sempre entram: as
+    LANE_CRITICAL_RESERVED últimas vagas são só delas. As normais ocupam o
+    resto e as de baixa prioridade (páginas, exportações, buscas) no máximo
+    LANE_LOW_SLOTS. Quem não cabe recebe 503 na hora, sem esperar numa fila
+    atrás de um render de template. Streams sempre entram e não contam.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._inflight = {"critical": 0, "normal": 0, "low": 0}
+
+    def try_enter(self, lane):
+        if lane == "stream":
+            return True
+        with self._lock:
+            shared = self._inflight["normal"] + self._inflight["low"]
+            if lane == "low" and self._inflight["low"] >= LANE_LOW_SLOTS:
+                return False
+            if lane != "critical" and shared >= LANE_SLOTS - LANE_CRITICAL_RESERVED:
+                return False
+            self._inflight[lane] += 1
+            return True
+
+    def leave(self, lane):
+        if lane == "stream":
+            return
+        with self._lock:
+            self._inflight[lane] -= 1
+
+    def in_flight(self):
+        with self._lock:
+            return sum(self._inflight.values())
+
+
+request_lanes = RequestLanes()
+metrics.gauge("aurora_requests_in_flight", request_lanes.in_flight)
+
+
+def shed_response():
+    response = jsonify({"status": "error", "message": "Servidor ocupado, tente novamente."})
+    response.status_code = 503
+    response.headers["Retry-After"] = str(LANE_RETRY_AFTER)
+    return response
+
+
+@app.before_request
+def enter_lane():
+    """Admissão por classe; no modo ASGI ela já foi feita antes da thread"""
+    if admitted_lane.get() is not None:
+        return
+    waiting = request.args.get("wait", 0, type=float) > 0
+    lane = request_lane(request.path, request.method, request.endpoint, waiting)
+    if not request_lanes.try_enter(lane):
+        metrics.inc("aurora_requests_shed_total", lane=lane)
+        return shed_response()
+    g.lane = lane
+
+
+@app.teardown_request
+def leave_lane(exc):
+    lane = g.pop("lane", None)
+    if lane is not None:
+        request_lanes.leave(lane)
+
+# ============================================
+# ROTAS PÚBLICAS
+# ============================================
+
+@app.route("/")
+def index():
+    return render_template("index.html")
+
+@app.route("/mulher")
+def mulher():
+    """Painel da Mulher - ACESSO DIRETO"""
+    try:
+        _, contacts = contacts_cache.get(current_owner(create=True))
+        return render_template("mulher.html", contacts=contacts)
+    except Exception as e:
+        return f"Erro ao carregar página: {str(e)}"
+
+@app.route("/confidant")
+def confidant():
+    """Painel da Pessoa de Confiança
+
+    Aberto pelo link ?t=<token> que a usuária compartilha, passa a receber os
+    alertas dela.
+    """
+    token = request.args.get("t")
+    if token:
+        follow_token(token)
+        return redirect("/confidant")
+    return render_template("confidant.html")
+
+HISTORY_LIMIT = 100
+HISTORY_LIMIT_MAX = 500
+EXPORT_BATCH = 1000
+HISTORICO_PAGE = 20
+EXPORT_COLUMNS = ("id", "date", "name", "situation", "message", "lat", "lng", "created_at")
+
+
+def iter_alerts(clauses=(), params=(), batch=EXPORT_BATCH, fields=EXPORT_COLUMNS):
+    """Percorre os alertas em ordem de ID, um lote curto por consulta.
+
+    Cada lote é uma consulta por chave (id > último), então nenhuma leitura
+    longa fica aberta segurando o checkpoint do WAL. `fields` precisa
+    incluir o id.
+    """
+    conn = get_db()
+    columns = ", ".join(fields)
+    last_id = 0
+    while True:
+        where = " AND ".join(("id > ?",) + tuple(clauses))
+        rows = conn.execute(
+            f"SELECT {columns} FROM alerts WHERE {where} ORDER BY id LIMIT ?",
+            (last_id,) + tuple(params) + (batch,)
+        ).fetchall()
+        yield from rows
+        if len(rows) < batch:
+            return
+        last_id = rows[-1]["id"]
+
+
+@app.route("/historico")
+def historico():
+    """Histórico de alertas, paginado por ID (?before_id=), ou busca com ?q="""
+    query = request.args.get("q", "").strip()
+    if query:
+        page = max(0, min(request.args.get("page", 0, type=int), SEARCH_OFFSET_MAX // HISTORICO_PAGE))
+        alerts = search_alerts(get_db(), viewer_owners(), query, HISTORICO_PAGE, page * HISTORICO_PAGE)
+        next_url = url_for("historico", q=query, page=page + 1) if len(alerts) == HISTORICO_PAGE else None
+        return render_template("history.html", alerts=alerts, next_url=next_url, query=query)
+
+    before_id = request.args.get("before_id", type=int)
+    where, params = owner_clause(viewer_owners())
+    sql = f"SELECT * FROM alerts WHERE {where}"
+    if before_id is not None:
+        sql += " AND id < ?"
+        params.append(before_id)
+    sql += " ORDER BY id DESC LIMIT ?"
+    params.append(HISTORICO_PAGE)
+
+    alerts = get_db().execute(sql, params).fetchall()
+    next_url = url_for("historico", before_id=alerts[-1]["id"]) if len(alerts) == HISTORICO_PAGE else None
+    return render_template("history.html", alerts=alerts, next_url=next_url, query="")
+
+@app.route("/history_json")
+def history_json():
+    """API de alertas
+
+    Com ?since_id=N (ou o cabeçalho Last-Event-ID) devolve só os alertas mais
+    novos que N. A ETag vem do último ID gravado, então um poll sem novidades
+    responde 304 sem consultar a tabela nem serializar JSON. Com ?wait=S a
+    requisição fica aberta (long-poll) até chegar um alerta ou passar S segundos.
+
+    ?from=&to= (epoch em segundos ou ISO 8601) filtram pelo intervalo
+    [from, to) usando o índice de alerts.created_at.
+
+    ?fields=id,name,... limita as colunas lidas e devolvidas (o id vem sempre).
+
+    Paginação por chave: ?before_id=N&limit=L devolve os L alertas anteriores
+    a N, e o cabeçalho Link aponta para a próxima página.
+    """
+    try:
+        start = parse_time_param(request.args.get("from"))
+        end = parse_time_param(request.args.get("to"))
+    except ValueError:
+        return jsonify({"status": "error", "message": "Parâmetros from/to inválidos"}), 400
+    try:
+        fields = requested_fields(ALERT_FIELDS)
+    except ValueError as exc:
+        return fields_error(exc)
+
+    track_poller()
+    try:
+        owners = viewer_owners()
+        since_id = request.args.get("since_id", type=int)
+        if since_id is None:
+            since_id = request.headers.get("Last-Event-ID", type=int)
+        before_id = request.args.get("before_id", type=int)
+        limit = max(1, min(request.args.get("limit", HISTORY_LIMIT, type=int), HISTORY_LIMIT_MAX))
+        wait = min(request.args.get("wait", 0, type=float), LONG_POLL_MAX)
+
+        head = alerts_head(owners)
+        if since_id is not None and since_id >= head and wait > 0:
+            subscriber = broadcaster.subscribe(owners)
+            try:
+                # Confere de novo depois de assinar para não perder um alerta
+                # gravado entre a primeira leitura e a assinatura
+                if alerts_head(owners) <= since_id:
+                    subscriber.queue.get(timeout=wait)
+            except queue.Empty:
+                pass
+            finally:
+                broadcaster.unsubscribe(subscriber)
+            head = alerts_head(owners)
+
+        etag = f"alerts-{owners_tag(owners)}-{head}"
+        if request.if_none_match.contains_weak(etag):
+            response = app.response_class(status=304)
+        elif since_id is not None and since_id >= head:
+            response = jsonify([])
+        else:
+            where, params = owner_clause(owners)
+            clauses = [where]
+            if since_id is not None:
+                clauses.append("id > ?")
+                params.append(since_id)
+            if before_id is not None:
+                clauses.append("id < ?")
+                params.append(before_id)
+            if start is not None:
+                clauses.append("created_at >= ?")
+                params.append(start)
+            if end is not None:
+                clauses.append("created_at < ?")
+                params.append(end)
+            order = "created_at DESC, id DESC" if start is not None or end is not None else "id DESC"
+
+            rows = get_db().execute(
+                f"SELECT {select_columns(fields)} FROM alerts WHERE {' AND '.join(clauses)} ORDER BY {order} LIMIT ?",
+                params + [limit]
+            ).fetchall()
+            response = jsonify([dict(row) for row in rows])
+            if len(rows) == limit and start is None and end is None:
+                args = request.args.to_dict()
+                args.update(before_id=rows[-1]["id"], limit=limit)
+                args.pop("since_id", None)
+                response.headers["Link"] = f'<{url_for("history_json", **args)}>; rel="next"'
+
+        response.set_etag(etag, weak=True)
+        response.headers["Cache-Control"] = "no-cache"
+        return response
+    except:
+        return jsonify([])
+
+def stream_backlog(owners, since_id):
+    """Alertas perdidos desde since_id, reenviados ao abrir o stream"""
+    if since_id is None:
+        return []
+    where, params = owner_clause(owners)
+    rows = get_db().execute(
+        f"SELECT * FROM alerts WHERE {where} AND id > ? ORDER BY id LIMIT 100", params + [since_id]
+    ).fetchall()
+    return [dict(row) for row in rows]
+
+
+@app.route("/api/alerts/stream")
+def alerts_stream():
+    """Stream SSE de alertas para o painel do confidente
+
+    Reenvia primeiro o que veio depois de Last-Event-ID (ou ?since_id=) e
+    depois entrega cada alerta novo assim que é publicado, com heartbeat
+    periódico para manter a conexão viva em proxies.
+    """
+    since_id = request.headers.get("Last-Event-ID", type=int)
+    if since_id is None:
+        since_id = request.args.get("since_id", type=int)
+
+    owners = viewer_owners()
+    subscriber = broadcaster.subscribe(owners)
+    backlog = stream_backlog(owners, since_id)
+
+    def generate():
+        last_sent = since_id or 0
+        yield "retry: 3000\n\n"
+        for alert in backlog:
+            last_sent = alert["id"]
+            yield sse_event(alert)
+        while not subscriber.lagged:
+            try:
+                alert = subscriber.queue.get(timeout=SSE_HEARTBEAT)
+            except queue.Empty:
+                yield ": ping\n\n"
+                continue
+            if alert["id"] > last_sent:
+                last_sent = alert["id"]
+                yield sse_event(alert)
+
+    response = Response(stream_with_context(generate()), mimetype="text/event-stream")
+    response.call_on_close(lambda: broadcaster.unsubscribe(subscriber))
+    response.headers["Cache-Control"] = "no-cache"
+    response.headers["X-Accel-Buffering"] = "no"
+    return response
+
+@app.route("/api/alerts/export")
+def alerts_export():
+    """Exporta o histórico completo em ?format=ndjson (padrão) ou csv
+
+    A resposta é gerada linha a linha, em memória constante, e aceita o mesmo
+    filtro ?from=&to= e a mesma projeção ?fields= do /history_json.
+    """
+    try:
+        start = parse_time_param(request.args.get("from"))
+        end = parse_time_param(request.args.get("to"))
+    except ValueError:
+        return jsonify({"status": "error", "message": "Parâmetros from/to inválidos"}), 400
+    try:
+        fields = requested_fields(EXPORT_COLUMNS) or EXPORT_COLUMNS
+    except ValueError as exc:
+        return fields_error(exc)
+
+    where, params = owner_clause(viewer_owners())
+    clauses = [where]
+    if start is not None:
+        clauses.append("created_at >= ?")
+        params.append(start)
+    if end is not None:
+        clauses.append("created_at < ?")
+        params.append(end)
+
+    if request.args.get("format", "ndjson") == "csv":
+        def generate():
+            buffer = io.StringIO()
+            writer = csv.writer(buffer)
+            writer.writerow(fields)
+            for row in iter_alerts(clauses, params, fields=fields):
+                writer.writerow(tuple(row))
+                if buffer.tell() > 8192:
+                    yield buffer.getvalue()
+                    buffer.seek(0)
+                    buffer.truncate()
+            yield buffer.getvalue()
+
+        mimetype, filename = "text/csv", "alertas.csv"
+    else:
+        def generate():
+            for row in iter_alerts(clauses, params, fields=fields):
+                yield json.dumps(dict(row), ensure_ascii=False) + "\n"
+
+        mimetype, filename = "application/x-ndjson", "alertas.ndjson"
+
+    response = Response(stream_with_context(generate()), mimetype=mimetype)
+    response.headers["Content-Disposition"] = f"attachment; filename={filename}"
+    return response
+
+# ============================================
+# RETENÇÃO: ARQUIVO MENSAL DE ALERTAS ANTIGOS
+# ============================================
+
+# Desligado por padrão: alertas arquivados saem do histórico, da busca e das
+# estatísticas, então arquivar precisa ser uma escolha explícita
+ALERT_RETENTION_DAYS = int(os.environ.get('ALERT_RETENTION_DAYS', 0))  # 0 desliga
+ARCHIVE_DIR = os.environ.get('ARCHIVE_DIR', os.path.join(os.path.dirname(os.path.abspath(DB_PATH)), 'archive'))
+RETENTION_INTERVAL = 3600  # segundos entre rodadas
+RETENTION_BATCH = 500  # alertas movidos por transação
+RETENTION_PAUSE = 0.05  # segundos entre lotes, para a thread de escrita passar
+ARCHIVE_COLUMNS = EXPORT_COLUMNS + ("owner",)
+ARCHIVE_FILE = re.compile(r"alerts-(\d{4}-\d{2})\.db")
+
+ARCHIVE_SCHEMA = (
+    """
+    CREATE TABLE IF NOT EXISTS archive.alerts (
+        id INTEGER PRIMARY KEY,
+        date TEXT NOT NULL,
+        name TEXT NOT NULL,
+        situation TEXT NOT NULL,
+        message TEXT,
+        lat REAL,
+        lng REAL,
+        created_at INTEGER,
+        owner TEXT NOT NULL
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS archive.idx_alerts_owner_id ON alerts(owner, id)",
+    """
+    CREATE TABLE IF NOT EXISTS archive.alert_locations (
+        id INTEGER PRIMARY KEY,
+        alert_id INTEGER NOT NULL,
+        lat REAL NOT NULL,
+        lng REAL NOT NULL,
+        accuracy REAL,
+        recorded_at INTEGER NOT NULL
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS archive.idx_alert_locations_alert_id ON alert_locations(alert_id, id)",
+)
+
+
+def alert_month(created_at):
+    """Mês (AAAA-MM, horário de Brasília) do arquivo que guarda o alerta"""
+    return datetime.fromtimestamp(created_at, FUSO_BR).strftime("%Y-%m")
+
+
+def archive_path(month):
+    return os.path.join(ARCHIVE_DIR, f"alerts-{month}.db")
+
+
+def archive_old_alerts(conn, cutoff, batch=RETENTION_BATCH):
+    """Move um lote de alertas anteriores a `cutoff` para os arquivos mensais.
+
+    Cada mês é um banco SQLite anexado. A cópia (alerta e pontos do trajeto)
+    é commitada no arquivo antes de apagar da tabela quente, e o INSERT OR
+    IGNORE torna a repetição segura se o processo cair entre as duas
+    transações. Devolve quantos moveu.
+    """
+    rows = conn.execute(
+        "SELECT id, created_at FROM alerts WHERE created_at < ? ORDER BY created_at LIMIT ?",
+        (cutoff, batch)
+    ).fetchall()
+    months = {}
+    for row in rows:
+        months.setdefault(alert_month(row["created_at"]), []).append(row["id"])
+
+    if months:
+        os.makedirs(ARCHIVE_DIR, exist_ok=True)
+    columns = ", ".join(ARCHIVE_COLUMNS)
+    for month, ids in months.items():
+        placeholders = ", ".join("?" * len(ids))
+        conn.execute("ATTACH DATABASE ? AS archive", (archive_path(month),))
+        try:
+            with conn:
+                for ddl in ARCHIVE_SCHEMA:
+                    conn.execute(ddl)
+                conn.execute(
+                    f"INSERT OR IGNORE INTO archive.alerts ({columns}) "
+                    f"SELECT {columns} FROM main.alerts WHERE id IN ({placeholders})", ids
+                )
+                conn.execute(
+                    "INSERT OR IGNORE INTO archive.alert_locations "
+                    f"SELECT * FROM main.alert_locations WHERE alert_id IN ({placeholders})", ids
+                )
+            with conn:
+                conn.execute(f"DELETE FROM main.alerts WHERE id IN ({placeholders})", ids)
+        finally:
+            conn.execute("DETACH DATABASE archive")
+        metrics.inc("aurora_alerts_archived_total", len(ids))
+    return len(rows)
+
+
+def _retention_loop():
+    """Só um worker arquiva por vez: o que segurar o lock do arquivo"""
+    if fcntl is not None:
+        lock = open(os.path.join(ARCHIVE_DIR, ".retention.lock"), "a")
+        while True:
+            try:
+                fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                break
+            except OSError:
+                time.sleep(RETENTION_INTERVAL)
+
+    conn = connect_db()
+    while True:
+        cutoff = int(time.time()) - ALERT_RETENTION_DAYS * 86400
+        try:
+            moved = 0
+            while True:
+                count = archive_old_alerts(conn, cutoff)
+                moved += count
+                if count < RETENTION_BATCH:
+                    break
+                time.sleep(RETENTION_PAUSE)
+            if moved:
+                log_event(logging.INFO, "Alertas arquivados", total=moved, antes_de=cutoff)
+        except sqlite3.Error as e:
+            log_event(logging.ERROR, "Erro ao arquivar alertas", error=str(e))
+        time.sleep(RETENTION_INTERVAL)
+
+
+_retention_pid = None
+
+
+@app.before_request
+def start_retention():
+    """Sobe a thread de retenção uma vez por worker"""
+    global _retention_pid
+    if ALERT_RETENTION_DAYS <= 0 or _retention_pid == os.getpid():
+        return
+    _retention_pid = os.getpid()
+    os.makedirs(ARCHIVE_DIR, exist_ok=True)
+    threading.Thread(target=_retention_loop, name="alert-retention", daemon=True).start()
+
+
+def archived_months(start=None, end=None):
+    """Meses arquivados que cruzam [start, end), do mais novo ao mais antigo"""
+    try:
+        names = os.listdir(ARCHIVE_DIR)
+    except FileNotFoundError:
+        return []
+    months = sorted((m.group(1) for m in map(ARCHIVE_FILE.fullmatch, names) if m), reverse=True)
+    if start is not None:
+        months = [m for m in months if m >= alert_month(start)]
+    if end is not None:
+        months = [m for m in months if m <= alert_month(end - 1)]
+    return months
+
+
+@app.route("/api/alerts/archive")
+def alerts_archive():
+    """Consulta sob demanda aos alertas já arquivados
+
+    ?month=AAAA-MM ou ?from=&to= escolhem os arquivos; ?before_id=&limit=
+    paginam por chave, do mais novo ao mais antigo, e ?fields= recorta as
+    colunas. Cada arquivo é aberto só para leitura e só enquanto é consultado.
+    """
+    try:
+        start = parse_time_param(request.args.get("from"))
+        end = parse_time_param(request.args.get("to"))
+    except ValueError:
+        return jsonify({"status": "error", "message": "Parâmetros from/to inválidos"}), 400
+    try:
+        fields = requested_fields(EXPORT_COLUMNS) or EXPORT_COLUMNS
+    except ValueError as exc:
+        return fields_error(exc)
+
+    month = request.args.get("month")
+    if month is not None and not re.fullmatch(r"\d{4}-\d{2}", month):
+        return jsonify({"status": "error", "message": "Use ?month=AAAA-MM"}), 400
+    months = [month] if month is not None else archived_months(start, end)
+    before_id = request.args.get("before_id", type=int)
+    limit = max(1, min(request.args.get("limit", HISTORY_LIMIT, type=int), HISTORY_LIMIT_MAX))
+
+    where, params = owner_clause(viewer_owners())
+    clauses = [where]
+    if before_id is not None:
+        clauses.append("id < ?")
+        params.append(before_id)
+    if start is not None:
+        clauses.append("created_at >= ?")
+        params.append(start)
+    if end is not None:
+        clauses.append("created_at < ?")
+        params.append(end)
+    sql = (f"SELECT {', '.join(fields)} FROM alerts WHERE {' AND '.join(clauses)} "
+           f"ORDER BY id DESC LIMIT ?")
+
+    alerts = []
+    for name in months:
+        path = archive_path(name)
+        if not os.path.exists(path):
+            continue
+        conn = sqlite3.connect(f"file:{pathname2url(path)}?mode=ro", uri=True)
+        conn.row_factory = sqlite3.Row
+        try:
+            rows = conn.execute(sql, params + [limit - len(alerts)]).fetchall()
+        finally:
+            conn.close()
+        alerts.extend(dict(row) for row in rows)
+        if len(alerts) >= limit:
+            break
+
+    response = jsonify(alerts)
+    if len(alerts) == limit:
+        args = request.args.to_dict()
+        args.update(before_id=alerts[-1]["id"], limit=limit)
+        response.headers["Link"] = f'<{url_for("alerts_archive", **args)}>; rel="next"'
+    return response
+
+# ============================================
+# API DO BOTÃO DE PÂNICO - CORRIGIDO COM FUSO BR
+# ============================================
+
+IDEMPOTENCY_TTL = 600  # segundos que uma chave de idempotência é lembrada
+IDEMPOTENCY_MAX_KEYS = 10000
+PANIC_BUCKET_SIZE = 5  # alertas seguidos permitidos por cliente
+PANIC_REFILL_RATE = 0.5  # alertas por segundo devolvidos ao balde
+PANIC_MAX_CLIENTS = 10000
+
+
+class TtlMap:
+    """Dicionário limitado em que cada chave expira `ttl` segundos depois de gravada.
+
+    A ordem de inserção é também a ordem de expiração, então a limpeza só
+    olha o começo da fila; acima de `maxsize` as chaves mais antigas saem.
+    """
+
+    def __init__(self, ttl, maxsize):
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self._items = OrderedDict()
+
+    def _purge(self, now):
+        while self._items:
+            key, (expires, _) = next(iter(self._items.items()))
+            if expires > now and len(self._items) <= self.maxsize:
+                break
+            self._items.popitem(last=False)
+
+    def get(self, key, default=None):
+        now = time.monotonic()
+        self._purge(now)
+        item = self._items.get(key)
+        return item[1] if item is not None else default
+
+    def set(self, key, value):
+        now = time.monotonic()
+        self._items[key] = (now + self.ttl, value)
+        self._items.move_to_end(key)
+        self._purge(now)
+
+
+class PanicAdmission:
+    """Idempotência e controle de admissão do /api/panic, em memória por worker.
+
+    Uma chave Idempotency-Key já vista devolve o alerta original (se ainda
+    está sendo gravado, a repetição espera pelo mesmo resultado). Cada
+    cliente identificado (sessão ou aparelho) tem um balde de fichas: quando
+    esvazia, um alerta novo é agrupado no último alerta do cliente em vez de
+    virar outra linha e outra sirene. O primeiro alerta de um cliente sempre
+    passa.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._keys = TtlMap(IDEMPOTENCY_TTL, IDEMPOTENCY_MAX_KEYS)
+        self._clients = TtlMap(PANIC_BUCKET_SIZE / PANIC_REFILL_RATE + IDEMPOTENCY_TTL, PANIC_MAX_CLIENTS)
+
+    def claim(self, key):
+        """(Future do resultado, True se esta requisição deve gravar)"""
+        with self._lock:
+            future = self._keys.get(key)
+            if future is not None:
+                return future, False
+            future = Future()
+            self._keys.set(key, future)
+            return future, True
+
+    def forget(self, key):
+        """Libera a chave de uma gravação que falhou, para a repetição tentar de novo"""
+        with self._lock:
+            self._keys.set(key, None)
+
+    def admit(self, client):
+        """None se o alerta pode ser gravado, ou o resultado em que agrupá-lo"""
+        now = time.monotonic()
+        with self._lock:
+            tokens, updated, last = self._clients.get(client, (PANIC_BUCKET_SIZE, now, None))
+            tokens = min(PANIC_BUCKET_SIZE, tokens + (now - updated) * PANIC_REFILL_RATE)
+            if tokens >= 1 or last is None:
+                self._clients.set(client, (max(tokens - 1, 0), now, last))
+                return None
+            self._clients.set(client, (tokens, now, last))
+            return last
+
+    def record(self, client, result):
+        """Guarda o último alerta gravado pelo cliente"""
+        with self._lock:
+            tokens, updated, _ = self._clients.get(client, (PANIC_BUCKET_SIZE, time.monotonic(), None))
+            self._clients.set(client, (tokens, updated, result))
+
+
+panic_admission = PanicAdmission()
+
+
+def panic_client():
+    """Quem está apertando o botão: a dona da sessão ou o aparelho (X-Device-ID).
+
+    Sem nenhum dos dois devolve None e o alerta nunca é agrupado: o IP (e o
+    X-Forwarded-For, que o cliente escolhe) é compartilhado por aparelhos
+    diferentes atrás do NAT da operadora.
+    """
+    if "owner" in session:
+        return f"owner:{session['owner']}"
+    device = request.headers.get("X-Device-ID", "")[:128]
+    return f"device:{device}" if device else None
+
+
+@app.route("/api/panic", methods=["POST"])
+def api_panic():
+    """Grava um alerta
+
+    Com o cabeçalho Idempotency-Key, repetições da mesma chave (retry de rede
+    móvel, toque duplo) devolvem o alerta original sem gravar de novo.
+    """
+    key = request.headers.get("Idempotency-Key", "")[:128]
+    if not key:
+        return record_panic()
+
+    key = f"{current_owner()}:{key}"
+    while True:
+        future, claimed = panic_admission.claim(key)
+        if claimed:
+            break
+        try:
+            result = future.result(WRITE_TIMEOUT)
+        except FutureTimeout:
+            response = jsonify({"status": "error", "message": "Alerta ainda sendo gravado, tente novamente."})
+            response.headers["Retry-After"] = "1"
+            return response, 503
+        if result is not None:
+            metrics.inc("aurora_panic_replayed_total")
+            response = jsonify(result)
+            response.headers["Idempotent-Replayed"] = "true"
+            return response
+        # A gravação original falhou: esta repetição pode tentar de novo
+
+    response = app.make_response(record_panic())
+    if response.status_code == 200:
+        future.set_result(response.get_json())
+    else:
+        panic_admission.forget(key)
+        future.set_result(None)
+    return response
+
+
+def build_alert(data, agora):
+    """Monta a linha de alerts a partir do JSON enviado pelo aparelho"""
+    name = data.get("name", "Usuária")
+    situation = data.get("situation", "Emergência")
+    message = data.get("message", "")
+    
+    # CORREÇÃO: Pegar latitude e longitude (numéricas e dentro da faixa)
+    lat = parse_coordinate(data.get("lat"), 90)
+    lng = parse_coordinate(data.get("lng"), 180)
+    
+    if lat is None or lng is None:
+        lat = lng = None
+    
+    return {
+        "date": agora.strftime(FORMATO_DATA_BR),
+        "name": name,
+        "situation": situation,
+        "message": message,
+        "lat": lat,
+        "lng": lng,
+        "created_at": int(agora.timestamp()),
+        "owner": current_owner()
+    }
+
+
+def alert_result(alert_id, alert):
+    """Resposta de um alerta gravado"""
+    return {
+        "status": "ok", 
+        "message": "Alerta enviado!",
+        "id": alert_id,
+        "data": alert["date"],
+        "localizacao": f"{alert['lat']},{alert['lng']}" if alert["lat"] is not None else None,
+        "trail_token": trail_token(alert_id, int(time.time()) + TRAIL_WINDOW)
+    }
+
+
+def record_panic():
+    """Valida e grava o alerta da requisição atual"""
+    try:
+        # CORREÇÃO: Data e hora no fuso brasileiro
+        alert = build_alert(request.get_json(), datetime.now(FUSO_BR))
+
+        # Rajada do mesmo cliente: agrupa no último alerta em vez de gravar outro
+        client = panic_client()
+        previous = panic_admission.admit(client) if client is not None else None
+        if previous is not None:
+            metrics.inc("aurora_panic_coalesced_total")
+            # A posição nova não se perde: vira um ponto do trajeto do alerta anterior
+            if alert["lat"] is not None:
+                try:
+                    trail_buffer.add(previous["id"], [(alert["lat"], alert["lng"], None, alert["created_at"])])
+                except WriterBusy:
+                    pass
+            log_event(logging.INFO, "Alerta agrupado", alert_id=previous["id"], mensagem=alert["message"])
+            return jsonify(dict(previous, agrupado=True))
+
+        # Gravação em lote pela thread de escrita; sob rajada o servidor
+        # responde 503 rápido em vez de enfileirar sem limite
+        try:
+            alert_id = db_writer.submit(lambda conn: insert_alert(conn, alert)).result(WRITE_TIMEOUT)
+        except (WriterBusy, FutureTimeout):
+            log_event(logging.WARNING, "Fila de gravação cheia, alerta recusado")
+            response = jsonify({"status": "error", "message": "Servidor ocupado, tente novamente."})
+            response.headers["Retry-After"] = "1"
+            return response, 503
+        metrics.inc("aurora_alerts_inserted_total")
+        log_event(logging.INFO, "Alerta gravado", alert_id=alert_id, data=alert["date"], com_localizacao=alert["lat"] is not None)
+        
+        result = alert_result(alert_id, alert)
+        if client is not None:
+            panic_admission.record(client, result)
+        return jsonify(result)
+        
+    except Exception as e:
+        log.exception("Erro no alerta")
+        return jsonify({"status": "error", "message": str(e)}), 500
+
+
+PANIC_BATCH_MAX = 100
+CLIENT_CLOCK_SKEW = 300  # segundos que o relógio do aparelho pode estar adiantado
+OFFLINE_MAX_AGE = 7 * 86400  # alertas mais antigos que isso ficam com a hora do servidor
+
+
+def client_time(value, agora):
+    """Hora do alerta no aparelho (epoch em ms), se for plausível; senão `agora`"""
+    try:
+        moment = float(value) / 1000
+    except (TypeError, ValueError):
+        return agora
+    if not agora.timestamp() - OFFLINE_MAX_AGE <= moment <= agora.timestamp() + CLIENT_CLOCK_SKEW:
+        return agora
+    return datetime.fromtimestamp(min(moment, agora.timestamp()), FUSO_BR)
+
+
+@app.route("/api/panic/batch", methods=["POST"])
+def api_panic_batch():
+    """Grava vários alertas numa transação só (fila offline do service worker)
+
+    Recebe {"alerts": [...]}, cada item no formato do /api/panic mais
+    "timestamp" (epoch em ms do aparelho, preservado) e "idempotency_key".
+    Itens cuja chave já foi gravada devolvem o alerta original. A resposta
+    traz um resultado por item, na mesma ordem.
+    """
+    data = request.get_json(silent=True) or {}
+    items = data.get("alerts")
+    if not isinstance(items, list) or not items or len(items) > PANIC_BATCH_MAX:
+        return jsonify({"status": "error", "message": f"Envie de 1 a {PANIC_BATCH_MAX} alertas"}), 400
+    if not all(isinstance(item, dict) for item in items):
+        return jsonify({"status": "error", "message": "Alertas inválidos"}), 400
+
+    agora = datetime.now(FUSO_BR)
+    results = [None] * len(items)
+    pending = []  # (posição, alerta, chave, future) dos que serão gravados
+    repeated = []  # (posição, posição do primeiro item com a mesma chave)
+    first_with_key = {}
+    for index, item in enumerate(items):
+        key = str(item.get("idempotency_key") or "")[:128]
+        future, claimed = None, True
+        if key:
+            key = f"{current_owner()}:{key}"
+            # Chave repetida no próprio lote: fica com o resultado do primeiro
+            # item, sem esperar por um future que só este lote resolveria
+            if key in first_with_key:
+                repeated.append((index, first_with_key[key]))
+                continue
+            first_with_key[key] = index
+            future, claimed = panic_admission.claim(key)
+        if claimed:
+            pending.append((index, build_alert(item, client_time(item.get("timestamp"), agora)), key, future))
+            continue
+        try:
+            results[index] = future.result(WRITE_TIMEOUT)
+        except FutureTimeout:
+            pass
+        if results[index] is None:
+            # A gravação original falhou ou não terminou: esta vale como nova
+            pending.append((index, build_alert(item, client_time(item.get("timestamp"), agora)), key, Future()))
+        else:
+            metrics.inc("aurora_panic_replayed_total")
+
+    alerts = [alert for _, alert, _, _ in pending]
+    try:
+        ids = db_writer.submit(lambda conn: insert_alerts(conn, alerts)).result(WRITE_TIMEOUT) if alerts else []
+    except Exception as e:
+        for _, _, key, future in pending:
+            if key:
+                panic_admission.forget(key)
+                future.set_result(None)
+        if isinstance(e, (WriterBusy, FutureTimeout)):
+            response = jsonify({"status": "error", "message": "Servidor ocupado, tente novamente."})
+            response.headers["Retry-After"] = "1"
+            return response, 503
+        log.exception("Erro no lote de alertas")
+        return jsonify({"status": "error", "message": str(e)}), 500
+
+    for (index, alert, key, future), alert_id in zip(pending, ids):
+        results[index] = alert_result(alert_id, alert)
+        if key:
+            future.set_result(results[index])
+    for index, first in repeated:
+        results[index] = results[first]
+    metrics.inc("aurora_alerts_inserted_total", len(ids))
+    log_event(logging.INFO, "Lote de alertas gravado", total=len(ids), repetidos=len(items) - len(ids))
+    return jsonify({"status": "ok", "results": results})
+
+# ============================================
+# TRAJETO AO VIVO DOS ALERTAS ATIVOS
+# ============================================
+
+TRAIL_WINDOW = int(os.environ.get('TRAIL_WINDOW', 7200))  # segundos aceitando pontos após o alerta
+TRAIL_MIN_DISTANCE_M = 20  # ponto mais perto que isso do anterior é descartado...
+TRAIL_MAX_GAP = 60  # ...a menos que o último gravado tenha mais de N segundos
+TRAIL_MAX_ACCURACY_M = 500  # leituras de GPS mais imprecisas que isso são ignoradas
+TRAIL_REQUEST_MAX = 100  # pontos por requisição
+TRAIL_FLUSH_INTERVAL = 1.0  # segundos entre gravações do buffer
+TRAIL_BUFFER_MAX = 50000  # pontos aguardando gravação, somando todos os alertas
+TRAIL_MAX_ALERTS = 10000  # alertas ativos lembrados pelo filtro
+TRAIL_PAGE = 500
+
+
+def trail_token(alert_id, expires):
+    """Autoriza o envio de pontos do alerta até `expires` (epoch), sem sessão"""
+    signature = hmac.new(
+        app.secret_key.encode(), f"trail:{alert_id}:{expires}".encode(), hashlib.sha256
+    ).hexdigest()[:32]
+    return f"{expires}.{signature}"
+
+
+def check_trail_token(alert_id, token):
+    """'ok', 'expired' ou 'invalid'"""
+    token = token or ""
+    expires, _, _ = token.partition(".")
+    if not token.isascii() or not expires.isdigit():
+        return "invalid"
+    if not hmac.compare_digest(token.encode(), trail_token(alert_id, int(expires)).encode()):
+        return "invalid"
+    return "ok" if int(expires) > time.time() else "expired"
+
+
+def trail_point(item, now):
+    """(lat, lng, precisão, epoch) de um ponto enviado pelo aparelho, ou None"""
+    if not isinstance(item, dict):
+        return None
+    lat = parse_coordinate(item.get("lat"), 90)
+    lng = parse_coordinate(item.get("lng"), 180)
+    if lat is None or lng is None:
+        return None
+    accuracy = parse_coordinate(item.get("accuracy"), float("inf"))
+    if accuracy is not None and accuracy > TRAIL_MAX_ACCURACY_M:
+        return None
+    try:
+        moment = float(item.get("timestamp")) / 1000
+    except (TypeError, ValueError):
+        moment = now
+    if not now - TRAIL_WINDOW <= moment <= now + CLIENT_CLOCK_SKEW:
+        moment = now
+    return lat, lng, accuracy, int(min(moment, now))
+
+
+class TrailBuffer:
+    """Pontos de trajeto reduzidos em memória e gravados em lote.
+
+    Cada alerta guarda o último ponto aceito: um ponto novo só entra se
+    andou TRAIL_MIN_DISTANCE_M ou se passou TRAIL_MAX_GAP desde ele, então um
+    aparelho parado gera um ponto por minuto. Os aceitos de todos os alertas
+    vão para o DbWriter num único job a cada TRAIL_FLUSH_INTERVAL: muitos
+    alertas ativos custam um INSERT em lote por segundo, e o trajeto nunca
+    ocupa a fila de gravação dos alertas de pânico.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._points = []
+        self._last = TtlMap(TRAIL_WINDOW, TRAIL_MAX_ALERTS)  # alerta -> (lat, lng, epoch)
+        self._pid = None
+
+    def _start(self):
+        if self._pid != os.getpid():
+            self._pid = os.getpid()
+            self._points = []
+            threading.Thread(target=self._run, name="trail-flusher", daemon=True).start()
+
+    def last_point(self, alert_id):
+        """Último ponto aceito do alerta (da memória ou, na primeira vez, do banco)"""
+        with self._lock:
+            last = self._last.get(alert_id)
+        if last is None:
+            row = get_db().execute(
+                "SELECT lat, lng, recorded_at FROM alert_locations WHERE alert_id = ? ORDER BY id DESC LIMIT 1",
+                (alert_id,)
+            ).fetchone()
+            last = tuple(row) if row is not None else False
+        return last
+
+    def add(self, alert_id, points):
+        """Filtra os pontos do alerta e guarda os aceitos; devolve quantos.
+
+        Levanta WriterBusy se o buffer está cheio (o banco não dá conta).
+        """
+        points = sorted(points, key=lambda point: point[3])
+        last = self.last_point(alert_id)
+        with self._lock:
+            self._start()
+            last = self._last.get(alert_id, last)
+            kept = []
+            for lat, lng, accuracy, moment in points:
+                if last:
+                    if moment < last[2]:
+                        continue
+                    moved = haversine_km(last[0], last[1], lat, lng) * 1000
+                    if moved < TRAIL_MIN_DISTANCE_M and moment - last[2] < TRAIL_MAX_GAP:
+                        continue
+                kept.append((alert_id, lat, lng, accuracy, moment))
+                last = (lat, lng, moment)
+            if len(self._points) + len(kept) > TRAIL_BUFFER_MAX:
+                raise WriterBusy()
+            self._points.extend(kept)
+            self._last.set(alert_id, last)
+        return len(kept)
+
+    def _run(self):
+        while True:
+            time.sleep(TRAIL_FLUSH_INTERVAL)
+            self.flush()
+
+    def flush(self):
+        """Grava o que está no buffer num job só do DbWriter"""
+        with self._lock:
+            points, self._points = self._points, []
+        if not points:
+            return
+        try:
+            db_writer.submit(lambda conn: conn.executemany(
+                "INSERT INTO alert_locations (alert_id, lat, lng, accuracy, recorded_at) VALUES (?, ?, ?, ?, ?)",
+                points
+            )).result()
+        except WriterBusy:
+            # Fila dos alertas cheia: o trajeto espera a próxima rodada
+            with self._lock:
+                self._points[:0] = points
+            return
+        except Exception:
+            log.exception("Erro ao gravar trajeto")
+            metrics.inc("aurora_trail_points_total", len(points), result="dropped")
+            return
+        metrics.inc("aurora_trail_points_total", len(points), result="stored")
+
+
+trail_buffer = TrailBuffer()
+
+
+@app.route("/api/alerts/<int:alert_id>/locations", methods=["POST"])
+def alert_locations(alert_id):
+    """Recebe posições do aparelho depois do alerta
+
+    Corpo {"points": [{"lat", "lng", "accuracy", "timestamp"}, ...]}, com o
+    trail_token devolvido pelo /api/panic no cabeçalho X-Trail-Token. A
+    resposta sai assim que os pontos entram no buffer (202).
+    """
+    status = check_trail_token(alert_id, request.headers.get("X-Trail-Token"))
+    if status == "invalid":
+        return jsonify({"status": "error", "message": "Token de trajeto inválido"}), 403
+    if status == "expired":
+        return jsonify({"status": "error", "message": "Trajeto encerrado para este alerta"}), 410
+
+    data = request.get_json(silent=True) or {}
+    items = data.get("points")
+    if not isinstance(items, list) or not items or len(items) > TRAIL_REQUEST_MAX:
+        return jsonify({"status": "error", "message": f"Envie de 1 a {TRAIL_REQUEST_MAX} pontos"}), 400
+
+    now = time.time()
+    points = [point for point in (trail_point(item, now) for item in items) if point is not None]
+    try:
+        kept = trail_buffer.add(alert_id, points)
+    except WriterBusy:
+        metrics.inc("aurora_trail_points_total", len(items), result="refused")
+        response = jsonify({"status": "error", "message": "Servidor ocupado, tente novamente."})
+        response.headers["Retry-After"] = "5"
+        return response, 503
+    metrics.inc("aurora_trail_points_total", len(items) - kept, result="skipped")
+    return jsonify({"status": "ok", "received": len(items), "kept": kept}), 202
+
+
+@app.route("/api/alerts/<int:alert_id>/trail")
+def alert_trail(alert_id):
+    """Trajeto do alerta em ordem, só os pontos depois de ?since_id=N"""
+    conn = get_db()
+    alert = conn.execute("SELECT owner FROM alerts WHERE id = ?", (alert_id,)).fetchone()
+    if alert is None or alert["owner"] not in viewer_owners():
+        return jsonify({"status": "error", "message": "Alerta não encontrado"}), 404
+
+    since_id = request.args.get("since_id", 0, type=int)
+    rows = conn.execute(
+        "SELECT id, lat, lng, accuracy, recorded_at FROM alert_locations "
+        "WHERE alert_id = ? AND id > ? ORDER BY id LIMIT ?",
+        (alert_id, since_id, TRAIL_PAGE)
+    ).fetchall()
+    response = jsonify([dict(row) for row in rows])
+    response.headers["Cache-Control"] = "no-cache"
+    return response
+
+# ============================================
+# NOTIFICAÇÃO DOS CONTATOS
+# ============================================
+
+# Nenhum por padrão: o stub "log" (que escreve a mensagem, o local e o nome
+# do contato no log) só com NOTIFY_TRANSPORTS=log explícito
+NOTIFY_TRANSPORTS = tuple(t.strip() for t in os.environ.get('NOTIFY_TRANSPORTS', '').split(',') if t.strip())
+NOTIFY_BATCH = 50  # notificações reservadas por consulta
+NOTIFY_POLL = 1.0  # segundos entre checagens da fila (notify() acorda antes)
+NOTIFY_MAX_ATTEMPTS = 5
+NOTIFY_BACKOFF = 5  # segundos; dobra a cada tentativa
+NOTIFY_BACKOFF_MAX = 600
+NOTIFY_CLAIM_TIMEOUT = 120  # segundos até uma entrega presa em 'sending' voltar para a fila
+NOTIFY_HTTP_TIMEOUT = 10
+PUBLIC_URL = os.environ.get('PUBLIC_URL', '').rstrip('/')
+
+
+class LogTransport:
+    """Não envia nada: registra no log. Para desenvolvimento e testes"""
+    name = "log"
+    concurrency = 4
+
+    def send(self, notification):
+        log_event(logging.INFO, "Notificação (stub)", transport=self.name,
+                  contato=notification["contact_name"], texto=notification["text"])
+
+
+class WebhookTransport:
+    """POST do JSON da notificação para NOTIFY_WEBHOOK_URL"""
+    name = "webhook"
+    concurrency = 8
+
+    def __init__(self, url=None):
+        self.url = url or os.environ.get('NOTIFY_WEBHOOK_URL')
+
+    def send(self, notification):
+        if not self.url:
+            raise RuntimeError("NOTIFY_WEBHOOK_URL não configurada")
+        post_json(self.url, notification)
+
+
+class SmsGatewayTransport:
+    """SMS para o telefone do contato por um gateway HTTP (SMS_GATEWAY_URL)"""
+    name = "sms"
+    concurrency = 2
+
+    def __init__(self, url=None, token=None):
+        self.url = url or os.environ.get('SMS_GATEWAY_URL')
+        self.token = token or os.environ.get('SMS_GATEWAY_TOKEN')
+
+    def send(self, notification):
+        if not self.url:
+            raise RuntimeError("SMS_GATEWAY_URL não configurada")
+        headers = {"Authorization": f"Bearer {self.token}"} if self.token else {}
+        post_json(self.url, {"to": notification["phone"], "message": notification["text"]}, headers)
+
+
+def post_json(url, payload, headers=None):
+    """POST JSON; erro HTTP ou de rede vira exceção (e nova tentativa)"""
+    request_ = urllib.request.Request(
+        url, data=json.dumps(payload, ensure_ascii=False).encode(), method="POST",
+        headers={"Content-Type": "application/json", **(headers or {})}
+    )
+    with urllib.request.urlopen(request_, timeout=NOTIFY_HTTP_TIMEOUT) as response:
+        response.read()
+
+
+# Transportes disponíveis por nome; NOTIFY_TRANSPORTS escolhe os ativos
+TRANSPORTS = {}
+
+
+def register_transport(transport):
+    TRANSPORTS[transport.name] = transport
+
+
+for _transport in (LogTransport(), WebhookTransport(), SmsGatewayTransport()):
+    register_transport(_transport)
+
+
+def queue_notifications(conn, first_id, last_id):
+    """Uma notificação por contato da dona e transporte ativo, para os alertas
+    first_id..last_id. Roda na mesma transação que grava os alertas."""
+    now = int(time.time())
+    for transport in NOTIFY_TRANSPORTS:
+        conn.execute("""
+            INSERT INTO notifications (alert_id, contact_id, transport, next_attempt_at, updated_at)
+            SELECT a.id, c.id, ?, ?, ? FROM alerts a JOIN contacts c ON c.owner = a.owner
+            WHERE a.id BETWEEN ? AND ?
+        """, (transport, now, now, first_id, last_id))
+
+
+def notification_text(row):
+    """Texto curto (cabe num SMS) com o alerta e o link do confidente"""
+    text = f"🚨 AURORA: {row['name']} pediu ajuda ({row['situation']}) em {row['date']}."
+    if row["message"]:
+        text += f" \"{row['message'][:80]}\""
+    if row["lat"] is not None:
+        text += f" Local: https://maps.google.com/?q={row['lat']},{row['lng']}"
+    if PUBLIC_URL:
+        text += f" Acompanhe: {PUBLIC_URL}/confidant?t={row['token']}"
+    return text
+
+
+class NotificationDispatcher:
+    """Entrega as notificações pendentes fora do caminho do /api/panic.
+
+    Uma thread por worker reserva lotes da tabela notifications (UPDATE com
+    um id de reserva, atômico entre workers) e entrega cada uma no pool do
+    seu transporte, com tantas threads quanto o `concurrency` dele: um
+    gateway lento só ocupa as próprias threads. Falhas voltam para a fila
+    com backoff exponencial até NOTIFY_MAX_ATTEMPTS; o status de cada
+    tentativa fica no banco.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._pid = None
+        self._pools = {}
+        self._inflight = {}
+
+    def start(self):
+        with self._lock:
+            if self._pid == os.getpid() or not NOTIFY_TRANSPORTS:
+                return
+            self._pid = os.getpid()
+            active = [name for name in NOTIFY_TRANSPORTS if name in TRANSPORTS]
+            self._pools = {name: ThreadPoolExecutor(TRANSPORTS[name].concurrency,
+                                                    thread_name_prefix=f"notify-{name}")
+                           for name in active}
+            self._inflight = dict.fromkeys(active, 0)
+            threading.Thread(target=self._run, name="notify-dispatcher", daemon=True).start()
+
+    def wake(self):
+        """Avisa que há notificações novas na fila"""
+        self._wakeup.set()
+
+    def _run(self):
+        conn = connect_db()
+        while True:
+            try:
+                # Reserva por transporte só o que o pool dele consegue entregar
+                # agora, para nada ficar parado em 'sending' esperando thread
+                for name, pool in self._pools.items():
+                    with self._lock:
+                        free = TRANSPORTS[name].concurrency - self._inflight[name]
+                    if free <= 0:
+                        continue
+                    rows = self._claim(conn, min(free, NOTIFY_BATCH), "transport = ?", (name,))
+                    with self._lock:
+                        self._inflight[name] += len(rows)
+                    for row in rows:
+                        pool.submit(self._deliver, dict(row))
+                # Transporte que não está mais ativo: falha definitiva, sem pool
+                placeholders = ",".join("?" * len(self._pools))
+                for row in self._claim(conn, NOTIFY_BATCH, f"transport NOT IN ({placeholders})",
+                                       tuple(self._pools)):
+                    self._finish(dict(row), f"Transporte desconhecido: {row['transport']}", final=True)
+            except sqlite3.Error as e:
+                log_event(logging.ERROR, "Erro ao ler fila de notificações", error=str(e))
+            self._wakeup.wait(NOTIFY_POLL)
+            self._wakeup.clear()
+
+    def _claim(self, conn, limit, where, params):
+        """Reserva até `limit` notificações vencidas (ou presas em 'sending')
+        que satisfazem `where`"""
+        claim_id = secrets.token_hex(8)
+        now = int(time.time())
+        with conn:
+            conn.execute(f"""
+                UPDATE notifications SET status = 'sending', claimed_by = ?, updated_at = ?
+                WHERE id IN (
+                    SELECT id FROM notifications
+                    WHERE ((status = 'pending' AND next_attempt_at <= ?)
+                        OR (status = 'sending' AND updated_at <= ?))
+                      AND {where}
+                    ORDER BY id LIMIT ?
+                )
+            """, (claim_id, now, now, now - NOTIFY_CLAIM_TIMEOUT, *params, limit))
+        return conn.execute("""
+            SELECT n.id, n.transport, n.attempts, n.alert_id, n.contact_id,
+                   a.name, a.situation, a.message, a.date, a.lat, a.lng,
+                   c.name AS contact_name, c.phone, c.token
+            FROM notifications n
+            LEFT JOIN alerts a ON a.id = n.alert_id
+            LEFT JOIN contacts c ON c.id = n.contact_id
+            WHERE n.claimed_by = ?
+        """, (claim_id,)).fetchall()
+
+    def _deliver(self, row):
+        try:
+            if row["contact_name"] is None or row["name"] is None:
+                # Contato apagado (ou alerta arquivado) antes da entrega
+                self._finish(row, "Contato ou alerta não existe mais", final=True)
+                return
+            error = None
+            try:
+                TRANSPORTS[row["transport"]].send(dict(row, text=notification_text(row)))
+            except Exception as e:
+                error = str(e) or type(e).__name__
+            self._finish(row, error)
+        finally:
+            with self._lock:
+                self._inflight[row["transport"]] -= 1
+            self._wakeup.set()
+
+    def _finish(self, row, error, final=False):
+        attempts = row["attempts"] + 1
+        now = int(time.time())
+        if error is None:
+            status, next_attempt = "sent", now
+        elif final or attempts >= NOTIFY_MAX_ATTEMPTS:
+            status, next_attempt = "failed", now
+        else:
+            status, next_attempt = "pending", now + min(NOTIFY_BACKOFF * 2 ** (attempts - 1), NOTIFY_BACKOFF_MAX)
+        metrics.inc("aurora_notifications_total", transport=row["transport"], status=status)
+        if error is not None:
+            log_event(logging.WARNING, "Falha ao notificar contato", notification_id=row["id"],
+                      transport=row["transport"], tentativa=attempts, error=error)
+        try:
+            conn = get_db()
+            with conn:
+                conn.execute("""
+                    UPDATE notifications
+                    SET status = ?, attempts = ?, next_attempt_at = ?, last_error = ?, updated_at = ?
+                    WHERE id = ?
+                """, (status, attempts, next_attempt, error, now, row["id"]))
+            mark_write()
+        except sqlite3.Error as e:
+            log_event(logging.ERROR, "Erro ao gravar status da notificação", notification_id=row["id"], error=str(e))
+
+
+dispatcher = NotificationDispatcher()
+
+
+@app.before_request
+def start_dispatcher():
+    """Sobe o despachante de notificações uma vez por worker"""
+    dispatcher.start()
+
+
+@app.route("/api/alerts/<int:alert_id>/notifications")
+def alert_notifications(alert_id):
+    """Status de entrega das notificações de um alerta, por contato e transporte"""
+    where, params = owner_clause(viewer_owners(), "a.owner")
+    rows = get_db().execute(f"""
+        SELECT n.id, n.transport, n.status, n.attempts, n.last_error, n.updated_at,
+               c.name AS contact_name
+        FROM notifications n
+        JOIN alerts a ON a.id = n.alert_id
+        LEFT JOIN contacts c ON c.id = n.contact_id
+        WHERE n.alert_id = ? AND {where}
+        ORDER BY n.id
+    """, [alert_id] + params).fetchall()
+    return jsonify([dict(row) for row in rows])
+
+# ============================================
+# ESTATÍSTICAS
 # ============================================
 
-def get_db():
-    conn = sqlite3.connect('database.db')
-    conn.row_factory = sqlite3.Row
-    
-    # Tabela de alertas
-    conn.execute("""
-        CREATE TABLE IF NOT EXISTS alerts (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            date TEXT NOT NULL,
-            name TEXT NOT NULL,
-            situation TEXT NOT NULL,
-            message TEXT,
-            lat TEXT,
-            lng TEXT
-        )
-    """)
-    
-    # Tabela de contatos (pessoas de confiança)
-    conn.execute("""
-        CREATE TABLE IF NOT EXISTS contacts (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            name TEXT NOT NULL,
-            phone TEXT NOT NULL,
-            relationship TEXT
-        )
-    """)
-    
-    conn.commit()
-    
-    # Inserir contatos demo se não existirem
-    demo = conn.execute("SELECT COUNT(*) as total FROM contacts").fetchone()
-    if demo['total'] == 0:
-        conn.execute(
-            "INSERT INTO contacts (name, phone, relationship) VALUES (?, ?, ?)",
-            ("CLECI", "(11) 99999-9999", "Irmã")
-        )
-        conn.execute(
-            "INSERT INTO contacts (name, phone, relationship) VALUES (?, ?, ?)",
-            ("MARIA", "(11) 98888-7777", "Mãe")
-        )
-        conn.execute(
-            "INSERT INTO contacts (name, phone, relationship) VALUES (?, ?, ?)",
-            ("JOÃO", "(11) 97777-6666", "Pai")
-        )
-        conn.commit()
-    
-    return conn
+STATS_HOURS_MAX = 24 * 14
+STATS_DAYS_MAX = 366
+STATS_SITUATIONS = 20  # situações mais frequentes listadas
+
+
+def stat_series(conn, owners, bucket, fmt, step, count):
+    """Últimos `count` buckets (hora ou dia, UTC), com zero onde não houve alerta"""
+    now = int(time.time())
+    keys = [time.strftime(fmt, time.gmtime(now - step * i)) for i in reversed(range(count))]
+    where, params = owner_clause(owners)
+    rows = dict(conn.execute(
+        f"SELECT key, SUM(count) FROM stats WHERE {where} AND bucket = ? AND key >= ? GROUP BY key",
+        params + [bucket, keys[0]]
+    ).fetchall())
+    return [{"key": key, "count": rows.get(key, 0)} for key in keys]
+
+
+def read_stats(conn, owners, hours, days):
+    """Estatísticas das donas pela tabela stats: buscas pela chave primária, sem varrer alerts.
+
+    Os contatos contados são só os da própria sessão, como no /api/contacts.
+    """
+    where, params = owner_clause(owners)
+    totals = dict(conn.execute(
+        f"SELECT bucket, SUM(count) FROM stats WHERE {where} AND bucket = 'total' AND key = '' GROUP BY bucket",
+        params
+    ).fetchall())
+    contacts = conn.execute(
+        "SELECT count FROM stats WHERE owner = ? AND bucket = 'contacts' AND key = ''", (current_owner(),)
+    ).fetchone()
+    situations = conn.execute(
+        f"SELECT key, SUM(count) AS total FROM stats WHERE {where} AND bucket = 'situation' "
+        f"GROUP BY key ORDER BY total DESC LIMIT ?",
+        params + [STATS_SITUATIONS]
+    ).fetchall()
+    per_hour = stat_series(conn, owners, "hour", "%Y-%m-%dT%H", 3600, max(hours, 24))
+    return {
+        "total_alerts": totals.get("total", 0),
+        "total_contacts": contacts["count"] if contacts is not None else 0,
+        "last_24h": sum(item["count"] for item in per_hour[-24:]),
+        "by_situation": {row["key"]: row["total"] for row in situations},
+        "per_hour": per_hour[-hours:],
+        "per_day": stat_series(conn, owners, "day", "%Y-%m-%d", 86400, days),
+    }
+
+
+@app.route("/api/stats")
+def api_stats():
+    """Totais, alertas por situação e séries por hora (?hours=) e dia (?days=), em UTC.
+
+    Só conta os alertas que a sessão pode ver (viewer_owners).
+    """
+    hours = max(1, min(request.args.get("hours", 24, type=int), STATS_HOURS_MAX))
+    days = max(1, min(request.args.get("days", 30, type=int), STATS_DAYS_MAX))
+    response = jsonify(read_stats(get_db(), viewer_owners(), hours, days))
+    response.headers["Cache-Control"] = "no-cache"
+    return response
 
 # ============================================
-# ROTAS PÚBLICAS
+# BUSCA DE ALERTAS (FTS5)
 # ============================================
 
-@app.route("/")
-def index():
-    return render_template("index.html")
+SEARCH_LIMIT = 20
+SEARCH_LIMIT_MAX = 100
+SEARCH_OFFSET_MAX = 1000  # páginas muito fundas custam caro; refine a busca
+SEARCH_TERMS_MAX = 8
+# Pesos do bm25 por coluna: name, situation, message, owner
+SEARCH_WEIGHTS = "10.0, 5.0, 1.0, 0.0"
 
-@app.route("/mulher")
-def mulher():
-    """Painel da Mulher - ACESSO DIRETO"""
-    try:
-        conn = get_db()
-        contacts = conn.execute("SELECT * FROM contacts").fetchall()
-        conn.close()
-        return render_template("mulher.html", contacts=contacts)
-    except Exception as e:
-        return f"Erro ao carregar página: {str(e)}"
 
-@app.route("/confidant")
-def confidant():
-    """Painel da Pessoa de Confiança"""
-    return render_template("confidant.html")
+def search_expression(query, owners):
+    """Expressão MATCH segura a partir do texto digitado, ou None se vazio.
 
-@app.route("/history_json")
-def history_json():
-    """API de alertas"""
+    Só as palavras entram, cada uma entre aspas (nenhum operador do FTS5 vem
+    do usuário); a última vira prefixo para a busca funcionar enquanto se
+    digita. As donas restringem a coluna owner dentro do próprio índice.
+    """
+    terms = re.findall(r"\w+", query or "")[:SEARCH_TERMS_MAX]
+    if not terms:
+        return None
+    quoted = [f'"{term}"' for term in terms]
+    quoted[-1] += "*"
+    owner_terms = " OR ".join('"{}"'.format(owner.replace('"', '""')) for owner in owners)
+    return f"owner : ({owner_terms}) AND {{name situation message}} : ({' '.join(quoted)})"
+
+
+def search_alerts(conn, owners, query, limit, offset=0, fields=None):
+    """Alertas das donas que casam com a busca, mais relevantes primeiro"""
+    expression = search_expression(query, owners)
+    if expression is None:
+        return []
+    where, params = owner_clause(owners, "a.owner")
+    return conn.execute(f"""
+        SELECT {select_columns(fields, "a.")} FROM alerts_fts JOIN alerts a ON a.id = alerts_fts.rowid
+        WHERE alerts_fts MATCH ? AND {where}
+        ORDER BY bm25(alerts_fts, {SEARCH_WEIGHTS}), a.id DESC
+        LIMIT ? OFFSET ?
+    """, [expression] + params + [limit, offset]).fetchall()
+
+
+@app.route("/api/alerts/search")
+def alerts_search():
+    """Busca textual em nome, situação e mensagem (?q=), paginada por ?page=.
+
+    Usa o índice alerts_fts; alertas já movidos para o arquivo mensal não
+    entram. O cabeçalho Link aponta para a próxima página, e ?fields= recorta
+    as colunas como no /history_json.
+    """
+    query = request.args.get("q", "")
+    if search_expression(query, (DEFAULT_OWNER,)) is None:
+        return jsonify({"status": "error", "message": "Informe o texto da busca em ?q="}), 400
+
+    limit = max(1, min(request.args.get("limit", SEARCH_LIMIT, type=int), SEARCH_LIMIT_MAX))
+    page = max(0, request.args.get("page", 0, type=int))
+    offset = page * limit
+    if offset > SEARCH_OFFSET_MAX:
+        return jsonify({"status": "error", "message": "Página além do limite; refine a busca"}), 400
     try:
-        conn = get_db()
-        rows = conn.execute("SELECT * FROM alerts ORDER BY id DESC LIMIT 100").fetchall()
-        alerts = [dict(row) for row in rows]
-        conn.close()
-        return jsonify(alerts)
-    except:
-        return jsonify([])
+        fields = requested_fields(ALERT_FIELDS)
+    except ValueError as exc:
+        return fields_error(exc)
+
+    rows = search_alerts(get_db(), viewer_owners(), query, limit, offset, fields)
+    response = jsonify([dict(row) for row in rows])
+    if len(rows) == limit and offset + limit <= SEARCH_OFFSET_MAX:
+        args = request.args.to_dict()
+        args.update(page=page + 1, limit=limit)
+        response.headers["Link"] = f'<{url_for("alerts_search", **args)}>; rel="next"'
+    response.headers["Cache-Control"] = "no-cache"
+    return response
 
 # ============================================
-# API DO BOTÃO DE PÂNICO - CORRIGIDO COM FUSO BR
+# API DE MAPA (ÍNDICE ESPACIAL)
 # ============================================
 
-@app.route("/api/panic", methods=["POST"])
-def api_panic():
-    try:
-        data = request.get_json()
-        
-        name = data.get("name", "Usuária")
-        situation = data.get("situation", "Emergência")
-        message = data.get("message", "")
-        
-        # CORREÇÃO: Pegar latitude e longitude
-        lat = None
-        lng = None
-        
-        if data.get("lat") and data.get("lng"):
-            lat = str(data.get("lat"))
-            lng = str(data.get("lng"))
-            print(f"📍 Localização recebida: {lat}, {lng}")
+EARTH_RADIUS_KM = 6371.0
+KM_PER_DEGREE = 111.32
+
+
+def haversine_km(lat1, lng1, lat2, lng2):
+    """Distância em km entre dois pontos"""
+    lat1, lng1, lat2, lng2 = map(math.radians, (lat1, lng1, lat2, lng2))
+    a = math.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin((lng2 - lng1) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * math.asin(min(1.0, math.sqrt(a)))
+
+
+def alerts_in_box(conn, owners, min_lat, min_lng, max_lat, max_lng, start=None, limit=None):
+    """Alertas das donas dentro da caixa, pelo R*Tree (mais recentes primeiro).
+
+    O R*Tree guarda limites em float32 arredondados para fora: a busca nele é
+    por sobreposição (um ponto na borda da caixa não some) e as coordenadas
+    exatas do alerta decidem.
+    """
+    where, params = owner_clause(owners, "a.owner")
+    sql = f"""
+        SELECT a.* FROM alerts_geo g JOIN alerts a ON a.id = g.id
+        WHERE g.max_lat >= ? AND g.min_lat <= ? AND g.max_lng >= ? AND g.min_lng <= ?
+          AND a.lat BETWEEN ? AND ? AND a.lng BETWEEN ? AND ? AND {where}
+    """
+    params = [min_lat, max_lat, min_lng, max_lng, min_lat, max_lat, min_lng, max_lng] + params
+    if start is not None:
+        sql += " AND a.created_at >= ?"
+        params.append(start)
+    sql += " ORDER BY a.id DESC"
+    if limit is not None:
+        sql += " LIMIT ?"
+        params.append(limit)
+    return conn.execute(sql, params).fetchall()
+
+
+def nearest_alerts(conn, owners, lat, lng, n, start=None):
+    """Os N alertas mais próximos do ponto, com a distância em km.
+
+    Busca numa caixa que cresce até conter N candidatos; depois confirma com
+    uma caixa do tamanho da N-ésima distância, o que garante o resultado exato.
+    """
+    radius = 1.0
+    while True:
+        dlat = min(radius / KM_PER_DEGREE, 180.0)
+        dlng = min(radius / (KM_PER_DEGREE * max(math.cos(math.radians(lat)), 1e-6)), 360.0)
+        rows = alerts_in_box(conn, owners, lat - dlat, lng - dlng, lat + dlat, lng + dlng, start)
+        found = sorted(
+            ((haversine_km(lat, lng, row['lat'], row['lng']), row) for row in rows),
+            key=lambda item: item[0]
+        )[:n]
+        whole_world = dlat >= 180.0 and dlng >= 360.0
+        if len(found) < n and not whole_world:
+            radius *= 4
+        elif found and found[-1][0] > radius and not whole_world:
+            radius = found[-1][0]
         else:
-            print("📍 Localização NÃO fornecida")
-        
-        # CORREÇÃO: Data e hora no fuso brasileiro
-        fuso_br = pytz.timezone('America/Sao_Paulo')
-        agora = datetime.now(fuso_br)
-        data_formatada = agora.strftime("%d/%m/%Y %H:%M:%S")
-        
-        print(f"📅 Data formatada (BR): {data_formatada}")
-        
-        conn = get_db()
-        conn.execute("""
-            INSERT INTO alerts (date, name, situation, message, lat, lng)
-            VALUES (?, ?, ?, ?, ?, ?)
-        """, (
-            data_formatada,
-            name,
-            situation,
-            message,
-            lat,
-            lng
-        ))
-        conn.commit()
-        conn.close()
-        
-        return jsonify({
-            "status": "ok", 
-            "message": "Alerta enviado!",
-            "data": data_formatada,
-            "localizacao": f"{lat},{lng}" if lat and lng else None
-        })
-        
-    except Exception as e:
-        print(f"❌ Erro no alerta: {str(e)}")
-        return jsonify({"status": "error", "message": str(e)}), 500
+            return found
+
+
+@app.route("/api/alerts/area")
+def alerts_area():
+    """Alertas dentro de ?bbox=oeste,sul,leste,norte (mesma ordem do OpenStreetMap)"""
+    try:
+        min_lng, min_lat, max_lng, max_lat = (float(v) for v in request.args["bbox"].split(","))
+        start = parse_time_param(request.args.get("from"))
+    except (KeyError, ValueError):
+        return jsonify({"status": "error", "message": "Use ?bbox=oeste,sul,leste,norte"}), 400
+
+    limit = max(1, min(request.args.get("limit", 500, type=int), 2000))
+    rows = alerts_in_box(get_db(), viewer_owners(), min_lat, min_lng, max_lat, max_lng, start, limit)
+    return jsonify([dict(row) for row in rows])
+
+
+@app.route("/api/alerts/nearby")
+def alerts_nearby():
+    """Os ?n= alertas mais próximos de ?lat=&lng="""
+    lat = parse_coordinate(request.args.get("lat"), 90)
+    lng = parse_coordinate(request.args.get("lng"), 180)
+    try:
+        start = parse_time_param(request.args.get("from"))
+    except ValueError:
+        start = lat = None
+    if lat is None or lng is None:
+        return jsonify({"status": "error", "message": "Use ?lat=&lng= válidos"}), 400
+
+    n = max(1, min(request.args.get("n", 10, type=int), 200))
+    found = nearest_alerts(get_db(), viewer_owners(), lat, lng, n, start)
+    return jsonify([dict(row, distance_km=round(distance, 3)) for distance, row in found])
 
 # ============================================
 # API DE CONTATOS
@@ -160,11 +3060,28 @@ def api_panic():
 
 @app.route("/api/contacts", methods=["GET"])
 def get_contacts():
+    """Contatos de confiança da usuária, com ETag derivada da versão do cache.
+
+    ?fields= recorta as colunas; a lista já está em memória, então o recorte
+    é feito nela e não no SELECT.
+    """
     try:
-        conn = get_db()
-        contacts = conn.execute("SELECT * FROM contacts").fetchall()
-        conn.close()
-        return jsonify([dict(c) for c in contacts])
+        fields = requested_fields(CONTACT_FIELDS)
+    except ValueError as exc:
+        return fields_error(exc)
+    try:
+        owner = current_owner()
+        version, contacts = contacts_cache.get(owner)
+        etag = f"contacts-{owners_tag((owner,))}-{version}"
+        if request.if_none_match.contains_weak(etag):
+            response = app.response_class(status=304)
+        elif fields:
+            response = jsonify([{name: contact[name] for name in fields} for contact in contacts])
+        else:
+            response = jsonify(list(contacts))
+        response.set_etag(etag, weak=True)
+        response.headers["Cache-Control"] = "no-cache"
+        return response
     except:
         return jsonify([])
 
@@ -172,204 +3089,54 @@ def get_contacts():
 # ROTAS DE GERENCIAMENTO DE CONTATOS
 # ============================================
 
+# Tabelas de contatos já renderizadas: dona -> (versão do cache, HTML)
+_contacts_tables = OrderedDict()
+_contacts_tables_lock = threading.Lock()
+
+
+def contacts_table_html(owner):
+    """Linhas da tabela de contatos, re-renderizadas só quando a versão muda"""
+    version, contacts = contacts_cache.get(owner)
+    with _contacts_tables_lock:
+        cached = _contacts_tables.get(owner)
+    if cached is None or cached[0] != version:
+        ordered = sorted(contacts, key=lambda c: c['name'])
+        cached = (version, Markup(render_template("contatos_tabela.html", contacts=ordered)))
+        with _contacts_tables_lock:
+            _contacts_tables[owner] = cached
+            while len(_contacts_tables) > CONTACTS_CACHE_OWNERS:
+                _contacts_tables.popitem(last=False)
+    return cached[1]
+
+
 @app.route("/gerenciar-contatos")
 def gerenciar_contatos():
     """Página para gerenciar contatos (adicionar e excluir)"""
-    html = """
-    <!DOCTYPE html>
-    <html>
-    <head>
-        <title>Gerenciar Contatos - Aurora Shield</title>
-        <style>
-            body { 
-                background: #0a0015; 
-                color: white; 
-                font-family: Arial; 
-                padding: 20px; 
-                margin: 0;
-            }
-            .container { 
-                max-width: 800px; 
-                margin: 0 auto; 
-            }
-            h1 {
-                text-align: center;
-                background: linear-gradient(45deg, #ff2fd4, #7a00ff);
-                -webkit-background-clip: text;
-                -webkit-text-fill-color: transparent;
-                margin-bottom: 30px;
-            }
-            .card { 
-                background: #140022; 
-                padding: 25px; 
-                border-radius: 20px; 
-                box-shadow: 0 0 30px rgba(122, 0, 255, 0.3);
-                margin-bottom: 20px;
-            }
-            h2 {
-                color: #ff2fd4;
-                margin-top: 0;
-                margin-bottom: 20px;
-            }
-            .form-group {
-                display: flex;
-                flex-wrap: wrap;
-                gap: 10px;
-                margin-bottom: 20px;
-            }
-            input, button { 
-                padding: 12px; 
-                margin: 0; 
-                border-radius: 8px; 
-                font-size: 14px;
-            }
-            input {
-                flex: 1;
-                min-width: 150px;
-                background: #1d0030;
-                border: 2px solid #7a00ff;
-                color: white;
-            }
-            input:focus {
-                outline: none;
-                border-color: #ff2fd4;
-                box-shadow: 0 0 10px #ff2fd4;
-            }
-            button { 
-                background: #7a00ff; 
-                color: white; 
-                border: none; 
-                cursor: pointer; 
-                font-weight: bold;
-                padding: 12px 20px;
-                transition: 0.3s;
-            }
-            button:hover {
-                background: #9a40ff;
-                transform: scale(1.02);
-            }
-            table { 
-                width: 100%; 
-                margin-top: 20px; 
-                border-collapse: collapse;
-            }
-            th { 
-                color: #ff2fd4; 
-                text-align: left;
-                padding: 12px 8px;
-                border-bottom: 2px solid #7a00ff;
-            }
-            td { 
-                padding: 12px 8px; 
-                border-bottom: 1px solid #7a00ff40;
-            }
-            tr:hover {
-                background: #1d0030;
-            }
-            .delete-btn {
-                background: #ff2fd4;
-                color: white;
-                padding: 5px 10px;
-                border-radius: 5px;
-                text-decoration: none;
-                font-size: 12px;
-            }
-            .delete-btn:hover {
-                background: #ff4fdb;
-            }
-            .back-link {
-                display: inline-block;
-                margin-top: 20px;
-                color: #b366ff;
-                text-decoration: none;
-                padding: 10px 20px;
-                border: 1px solid #7a00ff;
-                border-radius: 8px;
-            }
-            .back-link:hover {
-                background: #7a00ff40;
-            }
-        </style>
-    </head>
-    <body>
-        <div class="container">
-            <h1>🛡️ AURORA SHIELD</h1>
-            
-            <div class="card">
-                <h2>📋 GERENCIAR CONTATOS DE CONFIANÇA</h2>
-                
-                <form method="POST" action="/adicionar-contato">
-                    <div class="form-group">
-                        <input type="text" name="name" placeholder="Nome completo" required>
-                        <input type="text" name="phone" placeholder="Telefone (com DDD)" required>
-                        <input type="text" name="relationship" placeholder="Parentesco (ex: Irmã, Mãe)">
-                        <button type="submit">➕ ADICIONAR</button>
-                    </div>
-                </form>
-                
-                <table>
-                    <tr>
-                        <th>ID</th>
-                        <th>Nome</th>
-                        <th>Telefone</th>
-                        <th>Relação</th>
-                        <th>Ação</th>
-                    </tr>
-    """
-    
-    conn = get_db()
-    contacts = conn.execute("SELECT * FROM contacts ORDER BY name").fetchall()
-    
-    for c in contacts:
-        html += f"""
-        <tr>
-            <td>#{c['id']}</td>
-            <td><strong>{c['name']}</strong></td>
-            <td>{c['phone']}</td>
-            <td>{c['relationship'] or '—'}</td>
-            <td>
-                <a href="/apagar-contato/{c['id']}" class="delete-btn" onclick="return confirm('Tem certeza que deseja excluir {c['name']}?')">🗑️ Excluir</a>
-            </td>
-        </tr>
-        """
-    
-    conn.close()
-    
-    html += """
-                </table>
-                
-                <div style="text-align: center; margin-top: 30px;">
-                    <a href="/" class="back-link">← VOLTAR AO INÍCIO</a>
-                    <a href="/mulher" class="back-link" style="margin-left: 10px;">👩 IR PARA MULHER</a>
-                    <a href="/confidant" class="back-link" style="margin-left: 10px;">👥 IR PARA CONFIDANTE</a>
-                </div>
-            </div>
-        </div>
-    </body>
-    </html>
-    """
-    return html
+    return render_template("gerenciar_contatos.html", tabela=contacts_table_html(current_owner(create=True)))
 
 @app.route("/apagar-contato/<int:id>")
 def apagar_contato(id):
     """Apaga um contato específico pelo ID"""
     try:
         conn = get_db()
+        owner = current_owner(create=True)
         
-        # Verificar se o contato existe
-        contato = conn.execute("SELECT name FROM contacts WHERE id = ?", (id,)).fetchone()
+        # Verificar se o contato existe (e é desta usuária)
+        contato = conn.execute("SELECT name FROM contacts WHERE id = ? AND owner = ?", (id, owner)).fetchone()
         
         if contato:
             conn.execute("DELETE FROM contacts WHERE id = ?", (id,))
+            version = current_contacts_version(conn, owner)
             conn.commit()
-            print(f"✅ Contato {contato['name']} (ID: {id}) apagado com sucesso!")
+            mark_write()
+            contacts_cache.removed(owner, id, version)
+            log_event(logging.INFO, "Contato apagado", contact_id=id)
         else:
-            print(f"❌ Contato ID {id} não encontrado!")
+            log_event(logging.WARNING, "Contato não encontrado", contact_id=id)
             
-        conn.close()
         return redirect("/gerenciar-contatos?success=1")
     except Exception as e:
-        print(f"❌ Erro ao apagar: {str(e)}")
+        log.exception("Erro ao apagar contato")
         return f"<h1 style='color:red'>Erro ao apagar: {str(e)}</h1><p><a href='/gerenciar-contatos'>Voltar</a></p>"
 
 @app.route("/adicionar-contato", methods=["POST"])
@@ -383,19 +3150,27 @@ def adicionar_contato():
         if not name or not phone:
             return "Nome e telefone são obrigatórios!", 400
         
+        owner = current_owner(create=True)
+        token = secrets.token_urlsafe(16)
         conn = get_db()
-        conn.execute(
-            "INSERT INTO contacts (name, phone, relationship) VALUES (?, ?, ?)",
-            (name, phone, relationship)
+        cursor = conn.execute(
+            "INSERT INTO contacts (name, phone, relationship, owner, token) VALUES (?, ?, ?, ?, ?)",
+            (name, phone, relationship, owner, token)
         )
+        version = current_contacts_version(conn, owner)
         conn.commit()
-        conn.close()
+        mark_write()
+        contacts_cache.added(
+            {"id": cursor.lastrowid, "name": name, "phone": phone, "relationship": relationship,
+             "owner": owner, "token": token},
+            version
+        )
         
-        print(f"✅ Contato {name} adicionado com sucesso!")
+        log_event(logging.INFO, "Contato adicionado", contact_id=cursor.lastrowid)
         return redirect("/gerenciar-contatos?success=1")
         
     except Exception as e:
-        print(f"❌ Erro ao adicionar: {str(e)}")
+        log.exception("Erro ao adicionar contato")
         return f"<h1 style='color:red'>Erro ao adicionar: {str(e)}</h1><p><a href='/gerenciar-contatos'>Voltar</a></p>"
 
 # ============================================
@@ -608,9 +3383,94 @@ def testar_sirene_direto():
 # ARQUIVOS ESTÁTICOS
 # ============================================
 
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+STATIC_DIR = os.path.join(BASE_DIR, 'static')
+COMPRESSIBLE = ('.css', '.js', '.json', '.svg', '.txt', '.html')
+IMMUTABLE = "public, max-age=31536000, immutable"
+
+
+def build_assets():
+    """Gera o manifesto de assets a partir do conteúdo de static/.
+
+    Cada arquivo ganha um nome com o hash do conteúdo (css/style.<hash>.css)
+    e os de texto são comprimidos uma vez em gzip (e brotli, se instalado).
+    Devolve (manifesto lógico -> versionado, arquivos versionados, versão).
+    """
+    manifest, files = {}, {}
+    for root, _, names in os.walk(STATIC_DIR):
+        for name in sorted(names):
+            full_path = os.path.join(root, name)
+            logical = os.path.relpath(full_path, STATIC_DIR).replace(os.sep, '/')
+            with open(full_path, 'rb') as f:
+                content = f.read()
+
+            digest = hashlib.sha256(content).hexdigest()[:10]
+            stem, ext = os.path.splitext(logical)
+            hashed = f"{stem}.{digest}{ext}"
+
+            encoded = {}
+            if ext in COMPRESSIBLE:
+                encoded['gzip'] = gzip.compress(content, 9, mtime=0)
+                if brotli is not None:
+                    encoded['br'] = brotli.compress(content, quality=11)
+                encoded = {k: v for k, v in encoded.items() if len(v) < len(content)}
+
+            manifest[logical] = hashed
+            files[hashed] = (logical, digest, encoded)
+
+    version = hashlib.sha256(json.dumps(manifest, sort_keys=True).encode()).hexdigest()[:10]
+    return manifest, files, version
+
+
+ASSET_MANIFEST, ASSET_FILES, ASSET_VERSION = build_assets()
+
+
+def asset_url(path):
+    """URL versionada de um arquivo de static/ (usada nos templates)"""
+    return f"/static/{ASSET_MANIFEST.get(path, path)}"
+
+
+app.jinja_env.globals['asset_url'] = asset_url
+
+
+def build_service_worker():
+    """service-worker.js com versão e lista de cache vindas do manifesto"""
+    with open(os.path.join(BASE_DIR, 'service-worker.js'), encoding='utf-8') as f:
+        source = f.read()
+    assets = {f"/static/{logical}": f"/static/{hashed}" for logical, hashed in ASSET_MANIFEST.items()}
+    prelude = (
+        f"const ASSET_VERSION = {json.dumps(ASSET_VERSION)};\n"
+        f"const ASSET_MANIFEST = {json.dumps(assets, indent=2, sort_keys=True)};\n\n"
+    )
+    return prelude + source
+
+
+SERVICE_WORKER = build_service_worker()
+
+
 @app.route('/static/<path:path>')
 def send_static(path):
-    return send_from_directory('static', path)
+    """Assets versionados são imutáveis (cache de 1 ano) e saem pré-comprimidos;
+    caminhos sem hash continuam funcionando, com revalidação por ETag."""
+    asset = ASSET_FILES.get(path)
+    if asset is None:
+        return send_from_directory(STATIC_DIR, path)
+
+    logical, digest, encoded = asset
+    for encoding in ('br', 'gzip'):
+        if encoding in encoded and encoding in request.accept_encodings:
+            response = Response(encoded[encoding], mimetype=mimetypes.guess_type(logical)[0])
+            response.headers['Content-Encoding'] = encoding
+            response.set_etag(f"{digest}-{encoding}")
+            response.make_conditional(request)
+            break
+    else:
+        response = send_from_directory(STATIC_DIR, logical)
+
+    response.headers['Cache-Control'] = IMMUTABLE
+    if encoded:
+        response.vary.add('Accept-Encoding')
+    return response
 
 @app.route('/manifest.json')
 def manifest():
@@ -618,7 +3478,10 @@ def manifest():
 
 @app.route('/service-worker.js')
 def service_worker():
-    return send_from_directory('.', 'service-worker.js')
+    response = Response(SERVICE_WORKER, mimetype='application/javascript')
+    response.set_etag(ASSET_VERSION)
+    response.headers['Cache-Control'] = 'no-cache'
+    return response.make_conditional(request)
 
 # ============================================
 # ROTA DE DIAGNÓSTICO
@@ -627,23 +3490,79 @@ def service_worker():
 @app.route("/diagnostico")
 def diagnostico():
     try:
-        conn = get_db()
-        alerts = conn.execute("SELECT COUNT(*) as total FROM alerts").fetchone()
-        contacts = conn.execute("SELECT * FROM contacts").fetchall()
-        conn.close()
-        
-        html = "<h1 style='color:green'>✅ SISTEMA FUNCIONANDO!</h1>"
-        html += f"<p>🚨 Alertas no banco: {alerts['total']}</p>"
-        html += f"<p>👥 Contatos cadastrados: {len(contacts)}</p>"
-        html += "<h3>Contatos:</h3><ul>"
-        for c in contacts:
-            html += f"<li><strong>{c['name']}</strong> - {c['phone']} ({c['relationship']})</li>"
-        html += "</ul>"
-        html += '<p><a href="/">Voltar ao início</a> | <a href="/mulher">Ir para Mulher</a> | <a href="/confidant">Ir para Confidante</a> | <a href="/gerenciar-contatos">Gerenciar Contatos</a> | <a href="/testar-sirene">Testar Sirene</a></p>'
-        return html
+        return render_template("diagnostico.html", stats=read_stats(get_db(), viewer_owners(), 24, 7))
     except Exception as e:
         return f"<h1 style='color:red'>❌ ERRO: {str(e)}</h1>"
 
+# ============================================
+# MÉTRICAS
+# ============================================
+
+@app.route("/metrics")
+def metrics_endpoint():
+    """Métricas de todos os workers no formato texto do Prometheus"""
+    metrics.flush()
+    return Response(metrics.render(), mimetype="text/plain; version=0.0.4")
+
+# ============================================
+# AQUECIMENTO E HEALTH CHECKS
+# ============================================
+
+ready = threading.Event()
+_warm_up_pid = None
+
+
+def warm_up():
+    """Deixa o worker pronto para receber tráfego.
+
+    O schema já foi aplicado por init_db(); aqui os templates são compilados
+    e os caches do processo (contatos e tabela do painel demo) preenchidos, o
+    que também traz as páginas do banco para o cache do SQLite e do SO. Os
+    caches por thread (último alerta etc.) enchem na primeira requisição de
+    cada thread.
+    """
+    started = time.perf_counter()
+    for name in app.jinja_env.list_templates():
+        app.jinja_env.get_template(name)
+    with app.app_context():
+        contacts_table_html(DEFAULT_OWNER)
+    ready.set()
+    log_event(logging.INFO, "Worker aquecido", pid=os.getpid(),
+              templates=len(app.jinja_env.list_templates()),
+              ms=round((time.perf_counter() - started) * 1000, 1))
+
+
+@app.before_request
+def start_warm_up():
+    """Aquece em segundo plano uma vez por worker; /readyz responde 503 até lá"""
+    global _warm_up_pid
+    if _warm_up_pid == os.getpid():
+        return
+    _warm_up_pid = os.getpid()
+    ready.clear()
+    threading.Thread(target=warm_up, name="warm-up", daemon=True).start()
+
+
+@app.route("/healthz")
+def healthz():
+    """Liveness: o processo responde. Não toca no banco nem em templates"""
+    return "ok", 200, {"Content-Type": "text/plain", "Cache-Control": "no-store"}
+
+
+@app.route("/readyz")
+def readyz():
+    """Readiness: aquecimento concluído e conexão com o banco respondendo"""
+    if not ready.is_set():
+        return jsonify({"status": "warming"}), 503, {"Retry-After": "1"}
+    try:
+        get_db().execute("SELECT 1").fetchone()
+    except sqlite3.Error as e:
+        return jsonify({"status": "error", "message": str(e)}), 503
+    return jsonify({"status": "ready"}), 200, {"Cache-Control": "no-store"}
+
+
+start_warm_up()
+
 # ============================================
 # INICIALIZAÇÃO
 # ============================================
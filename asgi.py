@@ -0,0 +1,247 @@
+"""Modo de serviço assíncrono (ASGI) do Aurora
+
+    uvicorn asgi:app --workers 2
+
+O stream SSE (/api/alerts/stream) e a espera do long-poll do /history_json
+rodam no event loop: um confidente parado custa uma corrotina e uma fila,
+não uma thread. As consultas ao SQLite vão para um pool de threads dedicado
+e todas as demais rotas são as do Flask (app.py), chamadas via WSGI num pool
+fixo com uma thread por vaga de LANE_SLOTS (conexão e caches por thread
+sobrevivem entre requisições) e admitidas por classe de rota (app.RequestLanes):
+/api/panic nunca espera atrás de uma página. O modo síncrono
+(gunicorn app:app) continua disponível.
+"""
+
+import asyncio
+import os
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import parse_qsl, urlencode
+
+from asgiref.sync import sync_to_async
+from asgiref.wsgi import WsgiToAsgiInstance
+from flask import request
+
+import app as aurora
+
+DB_THREADS = int(os.environ.get('ASGI_DB_THREADS', 16))
+# Uma thread para cada vaga de app.RequestLanes: uma requisição admitida
+# (um /api/panic, por exemplo) nunca espera na fila do pool atrás de outras
+WSGI_THREADS = max(int(os.environ.get('ASGI_WSGI_THREADS', aurora.LANE_SLOTS)), aurora.LANE_SLOTS)
+
+db_pool = ThreadPoolExecutor(DB_THREADS, thread_name_prefix="asgi-db")
+wsgi_pool = ThreadPoolExecutor(WSGI_THREADS, thread_name_prefix="asgi-wsgi")
+
+
+class PooledWsgiInstance(WsgiToAsgiInstance):
+    """WsgiToAsgi que roda o Flask no wsgi_pool em vez da thread única por
+    processo do asgiref: as requisições correm em paralelo e cada thread
+    mantém sua conexão SQLite (app.get_db) de uma requisição para outra"""
+    # vars(): a função síncrona original, sem passar pelo __get__ do decorador
+    run_wsgi_app = sync_to_async(vars(WsgiToAsgiInstance)["run_wsgi_app"].func,
+                                 thread_sensitive=False, executor=wsgi_pool)
+
+
+async def run_db(fn, *args):
+    """Roda fn(*args) no pool do banco, fora do event loop"""
+    return await asyncio.get_running_loop().run_in_executor(db_pool, fn, *args)
+
+
+async def send_shed(send):
+    """503 de descarte enviado direto do event loop, sem ocupar thread"""
+    with aurora.app.app_context():
+        response = aurora.shed_response()
+    await send({
+        "type": "http.response.start",
+        "status": response.status_code,
+        "headers": [(k.lower().encode("latin-1"), v.encode("latin-1")) for k, v in response.headers.items()],
+    })
+    await send({"type": "http.response.body", "body": response.get_data()})
+
+
+async def flask_app(scope, receive, send):
+    """Rotas do Flask com admissão por classe (ver app.RequestLanes)"""
+    lane = aurora.request_lane(scope["path"], scope["method"])
+    if not aurora.request_lanes.try_enter(lane):
+        aurora.metrics.inc("aurora_requests_shed_total", lane=lane)
+        await send_shed(send)
+        return
+    token = aurora.admitted_lane.set(lane)
+    try:
+        await PooledWsgiInstance(aurora.app)(scope, receive, send)
+    finally:
+        aurora.admitted_lane.reset(token)
+        aurora.request_lanes.leave(lane)
+
+
+class AsyncSubscriber(aurora.AlertSubscriber):
+    """Assinante com asyncio.Queue, alimentado pela thread do tailer"""
+
+    def __init__(self, owners, loop):
+        super().__init__(owners)
+        self.loop = loop
+        self.queue = asyncio.Queue(aurora.SSE_QUEUE_SIZE)
+
+    def deliver(self, alert):
+        if alert["owner"] in self.owners:
+            self.loop.call_soon_threadsafe(self._put, alert)
+
+    def _put(self, alert):
+        try:
+            self.queue.put_nowait(alert)
+        except asyncio.QueueFull:
+            self.lagged = True
+
+
+def request_context(scope):
+    """Contexto de requisição do Flask (sessão, cabeçalhos) para o scope ASGI"""
+    headers = [(k.decode("latin-1"), v.decode("latin-1")) for k, v in scope["headers"]]
+    client = scope.get("client") or ("", 0)
+    return aurora.app.test_request_context(
+        scope["path"], method=scope["method"], query_string=scope["query_string"].decode("latin-1"),
+        headers=headers, environ_base={"REMOTE_ADDR": client[0]}
+    )
+
+
+def poll_state(scope):
+    """(donas, since_id, último ID) de um /history_json"""
+    with request_context(scope):
+        since_id = request.args.get("since_id", type=int)
+        if since_id is None:
+            since_id = request.headers.get("Last-Event-ID", type=int)
+        owners = aurora.viewer_owners()
+        return owners, since_id, aurora.alerts_head(owners)
+
+
+def stream_state(scope):
+    """(donas, since_id) de um /api/alerts/stream"""
+    with request_context(scope):
+        since_id = request.headers.get("Last-Event-ID", type=int)
+        if since_id is None:
+            since_id = request.args.get("since_id", type=int)
+        return aurora.viewer_owners(), since_id
+
+
+async def wait_for_alert(subscriber, timeout, disconnected):
+    """Espera um alerta, o fim do timeout ou a desconexão do cliente"""
+    getter = asyncio.ensure_future(subscriber.queue.get())
+    done, _ = await asyncio.wait({getter, disconnected}, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+    if getter in done:
+        return getter.result()
+    getter.cancel()
+    return None
+
+
+def replay(message, receive):
+    """receive() que devolve primeiro uma mensagem já lida"""
+    pending = [message]
+
+    async def replayed():
+        return pending.pop() if pending else await receive()
+    return replayed
+
+
+def watch_disconnect(receive):
+    """Future que termina quando o cliente fecha a conexão"""
+    async def watch():
+        while (await receive())["type"] != "http.disconnect":
+            pass
+    return asyncio.ensure_future(watch())
+
+
+async def history_json(scope, receive, send):
+    """Long-poll: espera no event loop e só então chama a rota do Flask.
+
+    A resposta (ETag, 304, filtros, paginação) continua sendo a do Flask,
+    que recebe a requisição sem ?wait= e por isso responde na hora.
+    """
+    args = parse_qsl(scope["query_string"].decode("latin-1"), keep_blank_values=True)
+    try:
+        wait = min(float(dict(args).get("wait", 0)), aurora.LONG_POLL_MAX)
+    except ValueError:
+        wait = 0
+    if wait > 0:
+        owners, since_id, head = await run_db(poll_state, scope)
+        if since_id is not None and since_id >= head:
+            # O corpo (vazio) do GET é lido aqui e repassado ao Flask depois,
+            # para que a espera possa acompanhar a desconexão do cliente
+            request_message = await receive()
+            disconnected = watch_disconnect(receive)
+            receive = replay(request_message, receive)
+            subscriber = aurora.broadcaster.attach(AsyncSubscriber(owners, asyncio.get_running_loop()))
+            try:
+                # Confere de novo depois de assinar para não perder um alerta
+                # gravado entre a primeira leitura e a assinatura
+                _, _, head = await run_db(poll_state, scope)
+                if head <= since_id:
+                    await wait_for_alert(subscriber, wait, disconnected)
+            finally:
+                aurora.broadcaster.unsubscribe(subscriber)
+                disconnected.cancel()
+        query = urlencode([(k, v) for k, v in args if k != "wait"]).encode("latin-1")
+        scope = dict(scope, query_string=query)
+    await flask_app(scope, receive, send)
+
+
+async def alerts_stream(scope, receive, send):
+    """Stream SSE servido direto no event loop, uma corrotina por confidente"""
+    owners, since_id = await run_db(stream_state, scope)
+    subscriber = aurora.broadcaster.attach(AsyncSubscriber(owners, asyncio.get_running_loop()))
+    disconnected = watch_disconnect(receive)
+    aurora.metrics.inc("aurora_http_requests_total", route="/api/alerts/stream", method="GET", status=200)
+    try:
+        backlog = await run_db(aurora.stream_backlog, owners, since_id)
+        await send({
+            "type": "http.response.start",
+            "status": 200,
+            "headers": [
+                (b"content-type", b"text/event-stream; charset=utf-8"),
+                (b"cache-control", b"no-cache"),
+                (b"x-accel-buffering", b"no"),
+            ],
+        })
+
+        async def emit(text):
+            await send({"type": "http.response.body", "body": text.encode(), "more_body": True})
+
+        last_sent = since_id or 0
+        await emit("retry: 3000\n\n")
+        for alert in backlog:
+            last_sent = alert["id"]
+            await emit(aurora.sse_event(alert))
+        while not subscriber.lagged and not disconnected.done():
+            alert = await wait_for_alert(subscriber, aurora.SSE_HEARTBEAT, disconnected)
+            if alert is None:
+                if not disconnected.done():
+                    await emit(": ping\n\n")
+            elif alert["id"] > last_sent:
+                last_sent = alert["id"]
+                await emit(aurora.sse_event(alert))
+        if not disconnected.done():
+            await send({"type": "http.response.body", "body": b"", "more_body": False})
+    except OSError:
+        pass  # cliente foi embora no meio de um envio
+    finally:
+        aurora.broadcaster.unsubscribe(subscriber)
+        disconnected.cancel()
+
+
+ROUTES = {
+    "/history_json": history_json,
+    "/api/alerts/stream": alerts_stream,
+}
+
+
+async def app(scope, receive, send):
+    if scope["type"] == "lifespan":
+        while True:
+            message = await receive()
+            if message["type"] == "lifespan.startup":
+                aurora.metrics.start_flusher()
+                await send({"type": "lifespan.startup.complete"})
+            elif message["type"] == "lifespan.shutdown":
+                db_pool.shutdown(wait=False)
+                wsgi_pool.shutdown(wait=False)
+                await send({"type": "lifespan.shutdown.complete"})
+                return
+    handler = ROUTES.get(scope["path"]) if scope["type"] == "http" and scope["method"] == "GET" else None
+    await (handler or flask_app)(scope, receive, send)
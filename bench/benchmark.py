@@ -0,0 +1,423 @@
+"""Benchmark de carga do Aurora Shield (confidentes + botão de pânico).
+
+Simula N confidentes fazendo polling de /history_json (com since_id e ETag,
+como o confidant.js) e de /api/contacts, enquanto alertas chegam em
+/api/panic num ritmo constante e numa rajada no meio da execução. Antes de
+começar, a tabela de alertas pode ser crescida até um tamanho realista.
+
+Dois modos:
+    client    - Flask test client, dentro deste processo (sem rede)
+    gunicorn  - sobe o startCommand do render.yaml (o mesmo de produção) num
+                banco e num METRICS_DIR temporários e usa HTTP
+
+Exemplos:
+    python bench/benchmark.py --confidants 200 --duration 30 --seed-alerts 500000
+    python bench/benchmark.py --mode gunicorn --workers 2 --threads 32
+    python bench/benchmark.py --compare bench/results/anterior.json
+
+O resultado (vazão e p50/p95/p99 por endpoint) vai para bench/results/ em
+JSON; --compare mostra a diferença em relação a uma execução anterior.
+"""
+
+import argparse
+import http.client
+import json
+import os
+import platform
+import random
+import secrets
+import shlex
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+RESULTS_DIR = os.path.join(ROOT, "bench", "results")
+
+SITUATIONS = ("Violência física", "Agressão verbal", "Perseguição")
+
+
+# ============================================
+# COLETA DE LATÊNCIAS
+# ============================================
+
+class Recorder:
+    """Latências e status por endpoint, seguro entre threads"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.samples = {}
+        self.statuses = {}
+
+    def record(self, endpoint, seconds, status):
+        with self._lock:
+            self.samples.setdefault(endpoint, []).append(seconds)
+            counts = self.statuses.setdefault(endpoint, {})
+            counts[str(status)] = counts.get(str(status), 0) + 1
+
+    def summary(self, duration):
+        result = {}
+        for endpoint, samples in sorted(self.samples.items()):
+            ordered = sorted(samples)
+            result[endpoint] = {
+                "count": len(ordered),
+                "rps": round(len(ordered) / duration, 2),
+                "p50_ms": round(percentile(ordered, 50) * 1000, 3),
+                "p95_ms": round(percentile(ordered, 95) * 1000, 3),
+                "p99_ms": round(percentile(ordered, 99) * 1000, 3),
+                "max_ms": round(ordered[-1] * 1000, 3),
+                "statuses": self.statuses[endpoint],
+            }
+        return result
+
+
+def percentile(ordered, pct):
+    """Percentil por ranking mais próximo de uma lista já ordenada"""
+    if not ordered:
+        return 0.0
+    index = max(0, min(len(ordered) - 1, int(round(pct / 100 * len(ordered))) - 1))
+    return ordered[index]
+
+
+# ============================================
+# CLIENTES (TEST CLIENT OU HTTP)
+# ============================================
+
+class TestClientSession:
+    """Sessão sobre o Flask test client, no mesmo processo"""
+
+    def __init__(self, app):
+        self.client = app.test_client()
+
+    def request(self, method, path, body=None, headers=None):
+        response = self.client.open(path, method=method, json=body, headers=headers or {})
+        status, etag, data = response.status_code, response.headers.get("ETag"), response.get_data()
+        response.close()
+        return status, etag, data
+
+
+class HttpSession:
+    """Sessão HTTP keep-alive contra o gunicorn"""
+
+    def __init__(self, port):
+        self.port = port
+        self.conn = http.client.HTTPConnection("127.0.0.1", port, timeout=30)
+
+    def request(self, method, path, body=None, headers=None):
+        headers = dict(headers or {})
+        payload = None
+        if body is not None:
+            payload = json.dumps(body).encode()
+            headers["Content-Type"] = "application/json"
+        try:
+            self.conn.request(method, path, body=payload, headers=headers)
+            response = self.conn.getresponse()
+        except (http.client.HTTPException, OSError):
+            self.conn.close()
+            self.conn = http.client.HTTPConnection("127.0.0.1", self.port, timeout=30)
+            raise
+        return response.status, response.getheader("ETag"), response.read()
+
+
+def timed(recorder, endpoint, session, method, path, body=None, headers=None):
+    started = time.perf_counter()
+    try:
+        status, etag, data = session.request(method, path, body, headers)
+    except Exception:
+        recorder.record(endpoint, time.perf_counter() - started, "error")
+        return None, None, None
+    recorder.record(endpoint, time.perf_counter() - started, status)
+    return status, etag, data
+
+
+# ============================================
+# CARGA
+# ============================================
+
+def confidant_loop(new_session, recorder, stop, rng, interval, contacts_every):
+    """Um confidente: polling com since_id/ETag e, de tempos em tempos, contatos"""
+    session = new_session()
+    cursor, alerts_etag, contacts_etag = 0, None, None
+    time.sleep(rng.uniform(0, interval))
+    polls = 0
+    while not stop.is_set():
+        path = f"/history_json?since_id={cursor}" if cursor else "/history_json"
+        headers = {"If-None-Match": alerts_etag} if alerts_etag else {}
+        status, etag, data = timed(recorder, "GET /history_json", session, "GET", path, headers=headers)
+        if status == 200:
+            alerts_etag = etag
+            alerts = json.loads(data)
+            if alerts:
+                cursor = alerts[0]["id"]
+
+        polls += 1
+        if contacts_every and polls % contacts_every == 0:
+            headers = {"If-None-Match": contacts_etag} if contacts_etag else {}
+            status, etag, _ = timed(recorder, "GET /api/contacts", session, "GET", "/api/contacts", headers=headers)
+            if status == 200:
+                contacts_etag = etag
+
+        stop.wait(interval)
+
+
+def panic_body(i, rng):
+    return {
+        "name": f"Bench {i}",
+        "situation": rng.choice(SITUATIONS),
+        "message": "benchmark",
+        "lat": rng.uniform(-33.0, 5.0),
+        "lng": rng.uniform(-73.0, -35.0),
+    }
+
+
+def panic_headers(i):
+    """Cada alerta vem de um aparelho diferente, para não cair no agrupamento por cliente"""
+    return {"X-Device-ID": f"bench-{i}"}
+
+
+def panic_loop(new_session, recorder, stop, rng, rate):
+    """Alertas num ritmo constante (alertas por segundo)"""
+    session = new_session()
+    i = 0
+    while not stop.is_set():
+        timed(recorder, "POST /api/panic", session, "POST", "/api/panic", panic_body(i, rng), panic_headers(i))
+        i += 1
+        stop.wait(1.0 / rate)
+
+
+def panic_burst(new_session, recorder, seed, size):
+    """Rajada: `size` alertas disparados ao mesmo tempo"""
+    barrier = threading.Barrier(size)
+
+    def fire(i):
+        session = new_session()
+        body = panic_body(i, random.Random(f"{seed}:burst:{i}"))
+        barrier.wait()
+        timed(recorder, "POST /api/panic (burst)", session, "POST", "/api/panic", body, panic_headers(1_000_000 + i))
+
+    threads = [threading.Thread(target=fire, args=(i,)) for i in range(size)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+
+def seed_alerts(db_path, total, seed):
+    """Cresce a tabela de alertas direto no SQLite (o schema já existe)"""
+    import sqlite3
+
+    import app as aurora
+
+    rng = random.Random(f"{seed}:seed-alerts")
+    conn = sqlite3.connect(db_path)
+    existing = conn.execute("SELECT COUNT(*) FROM alerts").fetchone()[0]
+    now = int(time.time())
+    batch = []
+    for i in range(existing, total):
+        created_at = now - (total - i) * 60
+        batch.append((
+            datetime.fromtimestamp(created_at, aurora.FUSO_BR).strftime(aurora.FORMATO_DATA_BR),
+            f"Seed {i}", rng.choice(SITUATIONS), "seed",
+            rng.uniform(-33.0, 5.0), rng.uniform(-73.0, -35.0), created_at,
+        ))
+        if len(batch) == 10000:
+            _insert_seed(conn, batch)
+            batch = []
+    if batch:
+        _insert_seed(conn, batch)
+    conn.close()
+
+
+def _insert_seed(conn, rows):
+    with conn:
+        conn.executemany(
+            "INSERT INTO alerts (date, name, situation, message, lat, lng, created_at) VALUES (?, ?, ?, ?, ?, ?, ?)",
+            rows,
+        )
+
+
+# ============================================
+# EXECUÇÃO
+# ============================================
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def deployed_command():
+    """startCommand do render.yaml, já separado em argumentos"""
+    with open(os.path.join(ROOT, "render.yaml"), encoding="utf-8") as f:
+        for line in f:
+            key, _, value = line.strip().partition(":")
+            if key == "startCommand":
+                return shlex.split(value)
+    raise RuntimeError("startCommand não encontrado no render.yaml")
+
+
+def start_gunicorn(args, db_path):
+    """Sobe o comando de produção com --workers e --bind deste benchmark"""
+    port = free_port()
+    command, skip = [], False
+    for arg in deployed_command():
+        if skip:
+            skip = False
+        elif arg in ("--workers", "-w", "--bind", "-b"):
+            skip = True
+        else:
+            command.append(arg)
+    if command[0] == "gunicorn":
+        command[:1] = [sys.executable, "-m", "gunicorn"]
+    command += ["--workers", str(args.workers), "--bind", f"127.0.0.1:{port}", "--log-level", "warning"]
+    # DATABASE_PATH, METRICS_DIR e SECRET_KEY temporários vêm de os.environ (run)
+    env = dict(os.environ, ASGI_WSGI_THREADS=str(args.threads))
+    process = subprocess.Popen(command, cwd=ROOT, env=env)
+    deadline = time.time() + 30
+    while time.time() < deadline:
+        try:
+            HttpSession(port).request("GET", "/api/contacts")
+            return process, port
+        except OSError:
+            time.sleep(0.2)
+    process.terminate()
+    raise RuntimeError("gunicorn não respondeu em 30 s")
+
+
+def run(args):
+    workdir = tempfile.mkdtemp(prefix="aurora-bench-")
+    db_path = os.path.join(workdir, "bench.db")
+    # Banco, métricas e chave só desta execução: nada vaza para o /metrics
+    # de outro servidor no mesmo host, e os workers compartilham a sessão
+    os.environ["DATABASE_PATH"] = db_path
+    os.environ["METRICS_DIR"] = os.path.join(workdir, "metrics")
+    os.environ["SECRET_KEY"] = secrets.token_hex(32)
+    sys.path.insert(0, ROOT)
+
+    # Importar o app cria o schema e aplica as migrações no banco temporário
+    import app as aurora
+
+    if args.seed_alerts:
+        print(f"Semeando {args.seed_alerts} alertas...")
+        seed_alerts(db_path, args.seed_alerts, args.seed)
+
+    process = None
+    if args.mode == "gunicorn":
+        process, port = start_gunicorn(args, db_path)
+        new_session = lambda: HttpSession(port)
+    else:
+        new_session = lambda: TestClientSession(aurora.app)
+
+    recorder = Recorder()
+    stop = threading.Event()
+    # Um gerador por thread, derivado de --seed: cada confidente e cada
+    # alerta recebem os mesmos valores em todas as execuções
+    threads = [
+        threading.Thread(target=confidant_loop, args=(new_session, recorder, stop, random.Random(f"{args.seed}:confidant:{n}"),
+                                                      args.poll_interval, args.contacts_every))
+        for n in range(args.confidants)
+    ]
+    if args.panic_rate > 0:
+        threads.append(threading.Thread(target=panic_loop, args=(new_session, recorder, stop, random.Random(f"{args.seed}:panic"),
+                                                                 args.panic_rate)))
+
+    print(f"Rodando {args.duration}s: {args.confidants} confidentes, {args.panic_rate} alertas/s, rajada de {args.burst}")
+    started = time.perf_counter()
+    try:
+        for thread in threads:
+            thread.daemon = True
+            thread.start()
+        if args.burst:
+            time.sleep(args.duration / 2)
+            panic_burst(new_session, recorder, args.seed, args.burst)
+        time.sleep(max(0.0, args.duration - (time.perf_counter() - started)))
+        stop.set()
+        for thread in threads:
+            thread.join(timeout=10)
+    finally:
+        if process is not None:
+            process.terminate()
+            process.wait()
+    elapsed = time.perf_counter() - started
+
+    return {
+        "meta": {
+            "timestamp": datetime.now().isoformat(timespec="seconds"),
+            "commit": git_commit(),
+            "python": platform.python_version(),
+            "seed": args.seed,
+            "args": vars(args),
+            "elapsed_s": round(elapsed, 3),
+        },
+        "endpoints": recorder.summary(elapsed),
+    }
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def print_report(result, baseline=None):
+    base = (baseline or {}).get("endpoints", {})
+    print(f"\n{'endpoint':28} {'n':>7} {'rps':>9} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9}  status")
+    for endpoint, stats in result["endpoints"].items():
+        line = (f"{endpoint:28} {stats['count']:>7} {stats['rps']:>9} "
+                f"{stats['p50_ms']:>9} {stats['p95_ms']:>9} {stats['p99_ms']:>9}  {stats['statuses']}")
+        print(line)
+        if endpoint in base:
+            old = base[endpoint]
+            deltas = "  ".join(
+                f"{key} {delta(old[key], stats[key])}" for key in ("rps", "p50_ms", "p95_ms", "p99_ms")
+            )
+            print(f"{'':28} vs {baseline['meta'].get('commit')}: {deltas}")
+
+
+def delta(old, new):
+    if not old:
+        return "n/a"
+    return f"{(new - old) / old * 100:+.1f}%"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--mode", choices=("client", "gunicorn"), default="client")
+    parser.add_argument("--confidants", type=int, default=50, help="confidentes fazendo polling")
+    parser.add_argument("--poll-interval", type=float, default=3.0, help="segundos entre polls de cada confidente")
+    parser.add_argument("--contacts-every", type=int, default=10, help="a cada quantos polls buscar /api/contacts (0 = nunca)")
+    parser.add_argument("--panic-rate", type=float, default=2.0, help="alertas por segundo durante a execução")
+    parser.add_argument("--burst", type=int, default=50, help="alertas simultâneos no meio da execução (0 = sem rajada)")
+    parser.add_argument("--seed-alerts", type=int, default=0, help="tamanho da tabela de alertas antes de começar")
+    parser.add_argument("--seed", type=int, default=1234, help="semente dos dados aleatórios (mesma semente, mesma carga)")
+    parser.add_argument("--duration", type=float, default=10.0, help="duração em segundos")
+    parser.add_argument("--workers", type=int, default=2, help="workers do gunicorn (modo gunicorn)")
+    parser.add_argument("--threads", type=int, default=32, help="threads do Flask por worker, ASGI_WSGI_THREADS (modo gunicorn)")
+    parser.add_argument("--output", help="arquivo JSON de saída (padrão: bench/results/<data>.json)")
+    parser.add_argument("--compare", help="JSON de uma execução anterior para comparar")
+    args = parser.parse_args()
+
+    result = run(args)
+
+    baseline = None
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            baseline = json.load(f)
+    print_report(result, baseline)
+
+    output = args.output
+    if output is None:
+        os.makedirs(RESULTS_DIR, exist_ok=True)
+        output = os.path.join(RESULTS_DIR, f"{datetime.now():%Y%m%d-%H%M%S}-{args.mode}.json")
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(result, f, indent=2, ensure_ascii=False)
+    print(f"\nResultado salvo em {output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,18 +1,29 @@
 // ===============================
-// AURORA SERVICE WORKER - V1
+// AURORA SERVICE WORKER
 // ===============================
 
-const CACHE_NAME = "aurora-cache-v1";
+// ASSET_VERSION e ASSET_MANIFEST são gerados pelo servidor (app.py) a partir
+// do conteúdo de static/: quando um asset muda, a versão e o cache mudam junto.
+const CACHE_NAME = `aurora-cache-${ASSET_VERSION}`;
 
+// Inclui a sirene, para que já esteja em cache antes do primeiro alerta
 const urlsToCache = [
   "/",
-  "/static/css/style.css",
-  "/static/js/panic.js",
-  "/static/js/confidant.js",
-  "/static/images/logo.png",
-  "/manifest.json"
+  "/manifest.json",
+  ...Object.values(ASSET_MANIFEST)
 ];
 
+const HASHED_ASSETS = new Set(Object.values(ASSET_MANIFEST));
+
+// Fila offline do botão de pânico e do trajeto (IndexedDB), esvaziada por
+// Background Sync
+const QUEUE_DB = "aurora-offline";
+const QUEUE_STORE = "panic";
+const LOCATIONS_STORE = "locations";
+const SYNC_TAG = "aurora-panic";
+const BATCH_MAX = 100;
+const LOCATIONS_PATH = /^\/api\/alerts\/\d+\/locations$/;
+
 // INSTALAÇÃO
 self.addEventListener("install", event => {
   self.skipWaiting();
@@ -40,11 +51,35 @@ self.addEventListener("activate", event => {
 // FETCH
 self.addEventListener("fetch", event => {
 
-  // Ignora APIs
+  // Alerta de pânico: se a rede falhar, guarda para enviar depois
+  const url = new URL(event.request.url);
+  if (url.pathname === "/api/panic" && event.request.method === "POST") {
+    event.respondWith(panicFetch(event));
+    return;
+  }
+
+  // Trajeto ao vivo: mesma fila, para as posições não se perderem sem rede
+  if (LOCATIONS_PATH.test(url.pathname) && event.request.method === "POST") {
+    event.respondWith(locationsFetch(event));
+    return;
+  }
+
+  // Ignora as outras APIs
   if (event.request.url.includes("/api/")) {
     return;
   }
 
+  // Assets versionados nunca mudam: cache primeiro. Caminhos sem hash são
+  // atendidos pela versão atual do mesmo arquivo.
+  const path = new URL(event.request.url).pathname;
+  const hashed = HASHED_ASSETS.has(path) ? path : ASSET_MANIFEST[path];
+  if (event.request.method === "GET" && hashed) {
+    event.respondWith(
+      caches.match(hashed).then(cached => cached || fetch(hashed))
+    );
+    return;
+  }
+
   event.respondWith(
     fetch(event.request)
       .then(response => {
@@ -60,6 +95,140 @@ self.addEventListener("fetch", event => {
   );
 });
 
+// FILA OFFLINE
+function openQueue() {
+  return new Promise((resolve, reject) => {
+    const request = indexedDB.open(QUEUE_DB, 2);
+    request.onupgradeneeded = event => {
+      if (event.oldVersion < 1) {
+        request.result.createObjectStore(QUEUE_STORE, { keyPath: "idempotency_key" });
+      }
+      if (event.oldVersion < 2) {
+        request.result.createObjectStore(LOCATIONS_STORE, { keyPath: "id", autoIncrement: true });
+      }
+    };
+    request.onsuccess = () => resolve(request.result);
+    request.onerror = () => reject(request.error);
+  });
+}
+
+async function withQueue(mode, action, storeName = QUEUE_STORE) {
+  const db = await openQueue();
+  return new Promise((resolve, reject) => {
+    const tx = db.transaction(storeName, mode);
+    const result = action(tx.objectStore(storeName));
+    tx.oncomplete = () => resolve(result.result);
+    tx.onerror = () => reject(tx.error);
+  });
+}
+
+async function panicFetch(event) {
+  const body = await event.request.clone().json().catch(() => null);
+  try {
+    const response = await fetch(event.request);
+    // Rede de volta: aproveita para enviar o que ficou na fila
+    event.waitUntil(flushQueue().catch(() => {}));
+    return response;
+  } catch (error) {
+    if (!body) throw error;
+    await withQueue("readwrite", store => store.put({
+      ...body,
+      idempotency_key: event.request.headers.get("Idempotency-Key") || crypto.randomUUID(),
+      timestamp: body.timestamp || Date.now()
+    }));
+    if (self.registration.sync) {
+      await self.registration.sync.register(SYNC_TAG).catch(() => {});
+    }
+    return new Response(JSON.stringify({
+      status: "queued",
+      message: "Sem conexão: alerta guardado, será enviado quando a rede voltar."
+    }), { status: 202, headers: { "Content-Type": "application/json" } });
+  }
+}
+
+// Envia a fila em lotes para /api/panic/batch (um commit por lote)
+async function flushPanics() {
+  const queued = await withQueue("readonly", store => store.getAll());
+  for (let i = 0; i < queued.length; i += BATCH_MAX) {
+    const batch = queued.slice(i, i + BATCH_MAX);
+    const response = await fetch("/api/panic/batch", {
+      method: "POST",
+      headers: { "Content-Type": "application/json" },
+      credentials: "same-origin",
+      body: JSON.stringify({ alerts: batch })
+    });
+    // 5xx: o Background Sync tenta de novo; 4xx: lote inválido, descartado
+    if (response.status >= 500) {
+      throw new Error(`Falha ao enviar fila: ${response.status}`);
+    }
+    await withQueue("readwrite", store => {
+      batch.forEach(item => store.delete(item.idempotency_key));
+      return store;
+    });
+  }
+}
+
+async function locationsFetch(event) {
+  const body = await event.request.clone().json().catch(() => null);
+  const token = event.request.headers.get("X-Trail-Token");
+  // Pontos guardados vão antes: o servidor descarta posições mais antigas
+  // que a última recebida do alerta
+  await flushLocations().catch(() => {});
+  try {
+    return await fetch(event.request);
+  } catch (error) {
+    if (!body || !token) throw error;
+    await withQueue("readwrite", store => store.add({
+      url: event.request.url,
+      token: token,
+      points: body.points
+    }), LOCATIONS_STORE);
+    if (self.registration.sync) {
+      await self.registration.sync.register(SYNC_TAG).catch(() => {});
+    }
+    return new Response(JSON.stringify({
+      status: "queued",
+      message: "Sem conexão: posições guardadas, serão enviadas quando a rede voltar."
+    }), { status: 202, headers: { "Content-Type": "application/json" } });
+  }
+}
+
+// Envia os lotes de posições guardados, na ordem em que foram gravados
+async function flushLocations() {
+  const queued = await withQueue("readonly", store => store.getAll(), LOCATIONS_STORE);
+  for (const item of queued) {
+    const response = await fetch(item.url, {
+      method: "POST",
+      headers: { "Content-Type": "application/json", "X-Trail-Token": item.token },
+      body: JSON.stringify({ points: item.points })
+    });
+    // 5xx: tenta de novo depois; 4xx (token expirado, lote inválido): descartado
+    if (response.status >= 500) {
+      throw new Error(`Falha ao enviar trajeto: ${response.status}`);
+    }
+    await withQueue("readwrite", store => store.delete(item.id), LOCATIONS_STORE);
+  }
+}
+
+// Alertas primeiro, depois o trajeto
+async function flushQueue() {
+  await flushPanics();
+  await flushLocations();
+}
+
+self.addEventListener("sync", event => {
+  if (event.tag === SYNC_TAG) {
+    event.waitUntil(flushQueue());
+  }
+});
+
+// Navegadores sem Background Sync avisam pela página quando a rede volta
+self.addEventListener("message", event => {
+  if (event.data === "flush-queue") {
+    event.waitUntil(flushQueue().catch(() => {}));
+  }
+});
+
 // PUSH (FUTURO)
 self.addEventListener("push", event => {
   const data = event.data.json();
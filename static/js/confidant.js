@@ -1,5 +1,14 @@
 // Variáveis globais
 let lastId = 0;
+let cursor = 0; // Maior ID já recebido do servidor (usado no ?since_id=)
+let etag = null; // Validador do último poll (304 quando nada mudou)
+const FIELDS = 'id,date,name,situation,message,lat,lng,created_at'; // Só o que o painel mostra
+let recentAlerts = []; // Últimos alertas recebidos, do mais novo para o mais antigo
+let stream = null; // Conexão SSE com o servidor
+let pollTimer = null; // Polling de reserva quando não há SSE
+let trail = null; // Trajeto ao vivo do alerta atual (polling próprio)
+const TRAJETO_POLL_MS = 5000;
+const TRAJETO_DURACAO_MS = 2 * 60 * 60 * 1000; // mesma janela do servidor
 let audioEnabled = true; // MUDADO PARA TRUE POR PADRÃO
 let currentAlert = null;
 let audioPlayed = false; // Para não repetir o mesmo alerta
@@ -78,12 +87,17 @@ document.getElementById('btnClear').onclick = () => {
     infoData.textContent = '—';
     map.style.display = 'none';
     noLocation.style.display = 'flex';
+    stopTrail();
     stopSiren();
 };
 
 document.getElementById('btnReset').onclick = () => {
     lastId = 0;
+    cursor = 0;
+    etag = null;
+    recentAlerts = [];
     audioPlayed = false;
+    stopTrail();
     stopSiren();
     fetchAlerts();
 };
@@ -91,69 +105,152 @@ document.getElementById('btnReset').onclick = () => {
 // Buscar alertas
 async function fetchAlerts() {
     try {
-        const r = await fetch('/history_json', {
+        // Só pede o que chegou depois do último ID recebido
+        let url = `/history_json?fields=${FIELDS}`;
+        if (cursor) url += `&since_id=${cursor}`;
+        const headers = { 'Cache-Control': 'no-cache' };
+        if (etag) headers['If-None-Match'] = etag;
+
+        const r = await fetch(url, {
             cache: 'no-store',
-            headers: { 'Cache-Control': 'no-cache' }
+            headers: headers
         });
-        const data = await r.json();
-        
-        // Atualizar histórico
-        if (data.length > 0) {
-            let history = '';
-            for (let i = 0; i < Math.min(data.length, 5); i++) {
-                history += `<div class="history-item">📢 ${data[i].date} - ${data[i].name || 'Alerta'}</div>`;
-            }
-            if (historyItems) historyItems.innerHTML = history;
+
+        // Nada mudou desde o último poll
+        if (r.status === 304) return;
+        // 503 com o servidor sobrecarregado: tenta de novo no próximo poll
+        if (!r.ok) return;
+
+        etag = r.headers.get('ETag');
+        showAlerts(await r.json());
+    } catch (e) {
+        console.log('Erro ao buscar alertas');
+    }
+}
+
+// Atualiza histórico e painel com alertas recebidos (mais novo primeiro)
+function showAlerts(data) {
+    // Ignora o que já foi recebido (SSE e polling podem se sobrepor)
+    data = data.filter(a => a.id > cursor);
+
+    // Atualizar histórico
+    if (data.length > 0) {
+        cursor = data[0].id;
+        recentAlerts = data.concat(recentAlerts).slice(0, 5);
+
+        let history = '';
+        for (let i = 0; i < recentAlerts.length; i++) {
+            history += `<div class="history-item">📢 ${recentAlerts[i].date} - ${recentAlerts[i].name || 'Alerta'}</div>`;
         }
+        if (historyItems) historyItems.innerHTML = history;
+    }
+    
+    if (recentAlerts.length === 0) return;
+    
+    const latest = recentAlerts[0];
+    
+    if (latest.id !== lastId) {
+        lastId = latest.id;
+        currentAlert = latest;
+        audioPlayed = false;
         
-        if (data.length === 0) return;
+        // Atualizar UI
+        alertBox.className = 'alert active';
+        alertBox.textContent = '🚨 ALERTA DE EMERGÊNCIA!';
+        status.textContent = '🔴 ALERTA ATIVO';
         
-        const latest = data[0];
+        infoNome.textContent = latest.name || 'Anônimo';
+        infoSit.textContent = latest.situation || 'Emergência';
+        infoMsg.textContent = latest.message || '—';
+        infoData.textContent = latest.date || '—';
         
-        if (latest.id !== lastId) {
-            lastId = latest.id;
-            currentAlert = latest;
-            audioPlayed = false;
-            
-            // Atualizar UI
-            alertBox.className = 'alert active';
-            alertBox.textContent = '🚨 ALERTA DE EMERGÊNCIA!';
-            status.textContent = '🔴 ALERTA ATIVO';
-            
-            infoNome.textContent = latest.name || 'Anônimo';
-            infoSit.textContent = latest.situation || 'Emergência';
-            infoMsg.textContent = latest.message || '—';
-            infoData.textContent = latest.date || '—';
-            
-            // Mapa
-            if (latest.lat && latest.lng && latest.lat !== 'null' && latest.lng !== 'null') {
-                const lat = parseFloat(latest.lat);
-                const lng = parseFloat(latest.lng);
-                
-                if (!isNaN(lat) && !isNaN(lng)) {
-                    map.src = `https://www.openstreetmap.org/export/embed.html?bbox=${lng-0.01},${lat-0.01},${lng+0.01},${lat+0.01}&layer=mapnik&marker=${lat},${lng}`;
-                    map.style.display = 'block';
-                    noLocation.style.display = 'none';
-                } else {
-                    map.style.display = 'none';
-                    noLocation.style.display = 'flex';
-                }
-            } else {
-                map.style.display = 'none';
-                noLocation.style.display = 'flex';
-            }
-            
-            // Tocar sirene automaticamente se for um novo alerta
-            if (audioEnabled && !audioPlayed) {
-                audioPlayed = true;
-                playSiren();
-            }
+        // Mapa
+        // lat/lng chegam como números (ou null quando não há localização)
+        if (typeof latest.lat === 'number' && typeof latest.lng === 'number') {
+            showLocation(latest.lat, latest.lng);
+        } else {
+            map.style.display = 'none';
+            noLocation.style.display = 'flex';
         }
+        followTrail(latest);
+        
+        // Tocar sirene automaticamente se for um novo alerta
+        if (audioEnabled && !audioPlayed) {
+            audioPlayed = true;
+            playSiren();
+        }
+    }
+}
+
+function showLocation(lat, lng) {
+    map.src = `https://www.openstreetmap.org/export/embed.html?bbox=${lng-0.01},${lat-0.01},${lng+0.01},${lat+0.01}&layer=mapnik&marker=${lat},${lng}`;
+    map.style.display = 'block';
+    noLocation.style.display = 'none';
+}
+
+// Trajeto ao vivo do alerta atual: o mapa acompanha o último ponto recebido
+function followTrail(alert) {
+    stopTrail();
+    const until = (alert.created_at ? alert.created_at * 1000 : Date.now()) + TRAJETO_DURACAO_MS;
+    if (Date.now() > until) return;
+    trail = { alertId: alert.id, cursor: 0, until: until };
+    trail.timer = setInterval(fetchTrail, TRAJETO_POLL_MS);
+    fetchTrail();
+}
+
+function stopTrail() {
+    if (trail) clearInterval(trail.timer);
+    trail = null;
+}
+
+async function fetchTrail() {
+    const current = trail;
+    if (!current) return;
+    if (Date.now() > current.until) {
+        stopTrail();
+        return;
+    }
+    try {
+        const r = await fetch(`/api/alerts/${current.alertId}/trail?since_id=${current.cursor}`, { cache: 'no-store' });
+        if (r.status === 404) {
+            stopTrail();
+            return;
+        }
+        const points = await r.json();
+        if (current !== trail || points.length === 0) return;
+        const last = points[points.length - 1];
+        current.cursor = last.id;
+        showLocation(last.lat, last.lng);
     } catch (e) {
-        console.log('Erro ao buscar alertas');
+        console.log('Erro ao buscar trajeto');
     }
 }
 
+// Recebe alertas por SSE; cai para polling se o navegador não suportar
+// ou se a conexão for encerrada de vez
+function startStream() {
+    if (!window.EventSource) {
+        startPolling();
+        return;
+    }
+
+    stream = new EventSource(`/api/alerts/stream?since_id=${cursor}`);
+    stream.addEventListener('alert', event => {
+        showAlerts([JSON.parse(event.data)]);
+    });
+    stream.onerror = () => {
+        // O EventSource reconecta sozinho (com Last-Event-ID); só desiste se fechar
+        if (stream.readyState === EventSource.CLOSED) {
+            stream = null;
+            startPolling();
+        }
+    };
+}
+
+function startPolling() {
+    if (!pollTimer) pollTimer = setInterval(fetchAlerts, 3000);
+}
+
 // Iniciar com áudio habilitado
 document.addEventListener('DOMContentLoaded', () => {
     console.log('Confidante carregado - Áudio automático ativado');
@@ -168,7 +265,6 @@ document.addEventListener('DOMContentLoaded', () => {
         }
     }, { once: true });
     
-    // Iniciar polling
-    fetchAlerts();
-    setInterval(fetchAlerts, 3000);
+    // Carrega o histórico e passa a receber alertas em tempo real
+    fetchAlerts().then(startStream);
 });
\ No newline at end of file
@@ -1,5 +1,125 @@
 // Variáveis para controle do botão
 let isSending = false;
+let pendingKey = null; // Chave de idempotência do alerta ainda não confirmado
+const MAX_TENTATIVAS = 4;
+
+function newIdempotencyKey() {
+    if (window.crypto && crypto.randomUUID) return crypto.randomUUID();
+    return Date.now().toString(36) + Math.random().toString(36).slice(2);
+}
+
+// Identifica este aparelho para o servidor agrupar toques repetidos dele
+// (e só dele) num alerta só
+function deviceId() {
+    try {
+        let id = localStorage.getItem('aurora-device-id');
+        if (!id) {
+            id = newIdempotencyKey();
+            localStorage.setItem('aurora-device-id', id);
+        }
+        return id;
+    } catch (e) {
+        return '';
+    }
+}
+
+// Envia o alerta repetindo em falha de rede ou 503 com a MESMA chave:
+// o servidor devolve o alerta original em vez de gravar outro
+async function sendAlert(alertData) {
+    let lastError = null;
+    for (let tentativa = 0; tentativa < MAX_TENTATIVAS; tentativa++) {
+        try {
+            const response = await fetch('/api/panic', {
+                method: 'POST',
+                headers: {
+                    'Content-Type': 'application/json',
+                    'Idempotency-Key': pendingKey,
+                    'X-Device-ID': deviceId()
+                },
+                body: JSON.stringify(alertData)
+            });
+            if (response.status !== 503) return response;
+            const retryAfter = parseFloat(response.headers.get('Retry-After')) || 1;
+            lastError = new Error('Servidor ocupado');
+            await new Promise(r => setTimeout(r, retryAfter * 1000));
+        } catch (error) {
+            lastError = error;
+            await new Promise(r => setTimeout(r, 500 * 2 ** tentativa));
+        }
+    }
+    throw lastError;
+}
+
+// Trajeto ao vivo: depois do alerta, as posições seguem para o servidor
+// em lotes até o token do trajeto expirar
+const TRAJETO_ENVIO_MS = 5000;
+const TRAJETO_MAX_PONTOS = 500; // guardados enquanto a rede não volta
+let trail = null;
+
+function startTrail(alertId, token) {
+    stopTrail();
+    if (!navigator.geolocation || !token) return;
+    trail = {
+        url: `/api/alerts/${alertId}/locations`,
+        token: token,
+        expires: parseInt(token.split('.')[0], 10) * 1000,
+        points: [],
+        sending: false
+    };
+    trail.watch = navigator.geolocation.watchPosition(position => {
+        trail.points.push({
+            lat: position.coords.latitude,
+            lng: position.coords.longitude,
+            accuracy: position.coords.accuracy,
+            timestamp: position.timestamp
+        });
+        if (trail.points.length > TRAJETO_MAX_PONTOS) trail.points.shift();
+    }, error => {
+        console.warn('Erro no trajeto:', error);
+    }, { enableHighAccuracy: true, maximumAge: 5000 });
+    trail.timer = setInterval(sendTrail, TRAJETO_ENVIO_MS);
+}
+
+function stopTrail() {
+    if (!trail) return;
+    navigator.geolocation.clearWatch(trail.watch);
+    clearInterval(trail.timer);
+    trail = null;
+}
+
+async function sendTrail() {
+    const current = trail;
+    if (!current || current.sending) return;
+    if (Date.now() > current.expires) {
+        stopTrail();
+        return;
+    }
+    if (current.points.length === 0) return;
+
+    const batch = current.points.slice(0, 100);
+    current.sending = true;
+    try {
+        const response = await fetch(current.url, {
+            method: 'POST',
+            headers: {
+                'Content-Type': 'application/json',
+                'X-Trail-Token': current.token
+            },
+            body: JSON.stringify({ points: batch })
+        });
+        if (response.status === 403 || response.status === 410) {
+            stopTrail();
+        } else if (response.ok || response.status === 400) {
+            // 202 "queued": sem rede, o service worker guardou o lote
+            current.points.splice(0, batch.length);
+        }
+        // 503 ou outra falha: os pontos ficam para o próximo envio
+    } catch (error) {
+        console.warn('Trajeto sem rede, tentando depois');
+    } finally {
+        current.sending = false;
+    }
+}
 
 function selectTag(el) {
     document.querySelectorAll('.tag').forEach(t => t.classList.remove('active'));
@@ -84,23 +204,25 @@ async function panic() {
             situation: situation,
             message: message,
             lat: lat,
-            lng: lng
+            lng: lng,
+            timestamp: Date.now() // hora do toque, mantida se o alerta ficar na fila offline
         };
         
         console.log('Enviando alerta:', alertData);
         
-        // Envia alerta
-        const response = await fetch('/api/panic', {
-            method: 'POST',
-            headers: {
-                'Content-Type': 'application/json',
-            },
-            body: JSON.stringify(alertData)
-        });
+        // Envia alerta (um novo toque depois de uma falha reusa a chave)
+        if (!pendingKey) pendingKey = newIdempotencyKey();
+        const response = await sendAlert(alertData);
         
         const result = await response.json();
         
-        if (response.ok && result.status === 'ok') {
+        if (response.status === 202 && result.status === 'queued') {
+            // Sem rede: o service worker guardou o alerta e envia depois
+            pendingKey = null;
+            showStatus('📡 ' + result.message, 'error');
+        } else if (response.ok && result.status === 'ok') {
+            pendingKey = null;
+            startTrail(result.id, result.trail_token);
             // Sucesso
             showStatus('✅ ALERTA ENVIADO COM SUCESSO!', 'success');
             
@@ -141,6 +263,14 @@ async function testLocation() {
 document.addEventListener('DOMContentLoaded', function() {
     console.log('Panic.js carregado');
     
+    // O service worker guarda os alertas enviados sem rede
+    if ('serviceWorker' in navigator) {
+        navigator.serviceWorker.register('/service-worker.js');
+        window.addEventListener('online', () => {
+            navigator.serviceWorker.controller?.postMessage('flush-queue');
+        });
+    }
+    
     // Verifica permissão de localização
     if (navigator.permissions) {
         navigator.permissions.query({ name: 'geolocation' }).then(result => {